@@ -0,0 +1,93 @@
+"""命令行工具
+
+    python -m app.cli export-nginx [--output PATH] [--watch SECONDS] [--reload-cmd CMD]
+    python -m app.cli replay --rules RULES.json [--format jsonl|nginx] [--at TIME] [--json] LOG [LOG ...]
+"""
+from datetime import datetime, timezone
+import argparse
+import asyncio
+import itertools
+import json
+import subprocess
+
+from config import NGINX_EXPORT_PATH
+from .models import async_session
+from .services.gray_service import GrayService
+from .services.nginx_export import export_nginx_rules
+from .services.replay import load_rules_file, parse_records, read_lines, replay
+
+
+async def _export_once(args) -> int:
+    async with async_session() as session:
+        report = await export_nginx_rules(session, args.output, args.user_var)
+    print(report.summary())
+    print(f"已写入 {args.output}")
+    if args.reload_cmd:
+        subprocess.run(args.reload_cmd, shell=True, check=False)
+    return report.version
+
+
+async def export_nginx(args):
+    version = await _export_once(args)
+    if not args.watch:
+        return
+    # 规则集版本变化时重新导出
+    while True:
+        await asyncio.sleep(args.watch)
+        async with async_session() as session:
+            latest = await GrayService(session).get_rule_set_version()
+        if latest != version:
+            version = await _export_once(args)
+
+
+def _parse_time(value: str) -> float:
+    """ISO 时间转换为时间戳，不带时区按 UTC 处理"""
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的时间: {value}")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+async def replay_logs(args):
+    plan = load_rules_file(args.rules)
+    lines = itertools.chain.from_iterable(read_lines(path) for path in args.logs)
+    if args.limit:
+        lines = itertools.islice(lines, args.limit)
+    report = replay(plan, parse_records(lines, args.format), args.at)
+    if args.json:
+        print(json.dumps(report.to_dict(), ensure_ascii=False, indent=2))
+    else:
+        print(report.summary())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="灰度发布命令行工具")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export-nginx", help="把可表达的规则导出为 Nginx map/geo include 文件")
+    export.add_argument("--output", default=NGINX_EXPORT_PATH, help="输出路径（默认与 gray.conf 同目录）")
+    export.add_argument("--user-var", default="$cookie_username", help="白名单用户ID对应的 Nginx 变量")
+    export.add_argument("--watch", type=float, default=0, help="轮询间隔（秒），规则集变化时重新导出")
+    export.add_argument("--reload-cmd", default="", help="写入后执行的命令，如 'nginx -s reload'")
+    export.set_defaults(handler=export_nginx)
+
+    replay_cmd = commands.add_parser("replay", help="用候选规则集离线回放访问日志，统计命中率与决策耗时")
+    replay_cmd.add_argument("logs", nargs="+", help="日志文件（支持 .gz，- 表示标准输入）")
+    replay_cmd.add_argument("--rules", required=True, help="候选规则集 JSON 文件")
+    replay_cmd.add_argument("--format", choices=["jsonl", "nginx"], default="jsonl", help="日志格式")
+    replay_cmd.add_argument("--limit", type=int, default=0, help="最多回放的行数")
+    replay_cmd.add_argument(
+        "--at", type=_parse_time, default=None, help="没有请求时间的记录按该时刻评估定时规则（ISO 时间，不带时区按 UTC），默认当前时间"
+    )
+    replay_cmd.add_argument("--json", action="store_true", help="以 JSON 输出报告")
+    replay_cmd.set_defaults(handler=replay_logs)
+
+    args = parser.parse_args(argv)
+    asyncio.run(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,25 +2,48 @@
 import sys
 sys.path.insert(0, '..')
 
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, APIRouter, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 
-from .models import init_db, ApiResponse
+from .models import engine, init_db, ApiResponse
 from .routes import gray, admin
-from config import CORS_ORIGINS, HOST, PORT
+from .routes.fast_auth import fast_auth_app
+from .services.decision_log import decision_log
+from .services.gray_service import rules_cache, warm_up, watch_rule_changes
+from .services.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, instrument_engine, registry
+from .services.shadow import shadow_evaluator
+from config import CORS_ORIGINS, HOST, PORT, CACHE_SYNC_INTERVAL, DECISION_LOG_FLUSH_INTERVAL
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
-    # 启动时初始化数据库
-    await init_db()
-    print("✅ Database initialized")
+    # 启动时初始化数据库；失败时仍可从规则集快照提供决策
+    try:
+        await init_db()
+        print("✅ Database initialized")
+    except Exception as exc:
+        print(f"⚠️ Database initialization failed: {exc}")
+    # 预热规则缓存：编译完成后健康检查才报告就绪，首批 auth 子请求不再读库
+    if await warm_up():
+        print(f"✅ Rule cache loaded from {rules_cache.source} (version {rules_cache.version})")
+    # 后台轮询规则变更，保证多 worker 缓存一致
+    sync_task = asyncio.create_task(watch_rule_changes(CACHE_SYNC_INTERVAL))
+    # 决策审计日志后台写入
+    log_task = asyncio.create_task(decision_log.run(DECISION_LOG_FLUSH_INTERVAL)) if decision_log.enabled else None
+    # 影子规则后台评估
+    shadow_task = asyncio.create_task(shadow_evaluator.run())
     yield
     # 关闭时清理资源
+    sync_task.cancel()
+    shadow_task.cancel()
+    if log_task is not None:
+        log_task.cancel()
+        await asyncio.gather(log_task, return_exceptions=True)  # 等待缓冲区写完
     print("👋 Shutting down...")
 
 
@@ -36,8 +59,9 @@ app = FastAPI(
 
 ### Nginx 集成方式
 
-使用 `auth_request` 模块，Nginx 在处理请求前先调用 `/gray/auth` 接口获取灰度决策。
+使用 `auth_request` 模块，Nginx 在处理请求前先调用 `/gray/fast-auth` 接口获取灰度决策。
 决策结果通过响应头返回，Nginx 根据响应头决定路由到哪个上游服务。
+`/gray/auth` 返回相同的响应头并附带 JSON 决策详情，便于调试。
     """,
     version="1.0.0",
     lifespan=lifespan
@@ -60,6 +84,18 @@ api_router.include_router(admin.router)
 # 注册路由
 app.include_router(api_router)
 
+# auth_request 快速通道：原生 ASGI，不经过 FastAPI 依赖注入与响应序列化
+app.add_route("/api/gray/fast-auth", fast_auth_app, include_in_schema=False)
+
+# 数据库语句计时
+instrument_engine(engine)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """本 worker 的 Prometheus 指标"""
+    return Response(registry.render(), media_type=METRICS_CONTENT_TYPE)
+
 
 # ============== 全局异常处理 ==============
 
@@ -93,8 +129,10 @@ async def root():
         "endpoints": {
             "灰度决策": "/api/gray/decide",
             "Nginx认证": "/api/gray/auth",
+            "Nginx认证快速通道": "/api/gray/fast-auth",
             "规则管理": "/api/admin/rules",
-            "健康检查": "/api/gray/health"
+            "健康检查": "/api/gray/health",
+            "指标": "/metrics"
         }
     })
 
@@ -1,17 +1,53 @@
 """数据模型定义"""
-from datetime import datetime
-from typing import Optional, List
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, JSON
+from datetime import datetime, timezone
+from typing import Dict, Optional, List
+from sqlalchemy import (
+    Column, Integer, String, Boolean, DateTime, Text, JSON, Float, Index, event, inspect, text,
+)
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
-from pydantic import BaseModel, Field
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from pydantic import BaseModel, Field, field_serializer, field_validator, model_validator
 
 import sys
 sys.path.append('..')
-from config import DATABASE_URL
+from config import (
+    DATABASE_URL, DATABASE_ECHO,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_MMAP_SIZE, SQLITE_BUSY_TIMEOUT,
+)
+
+
+def _create_engine():
+    """
+    创建数据库引擎
+
+    aiosqlite 默认不复用连接（NullPool），每个会话都要新建连接和后台线程；
+    文件数据库改用连接池，并在建立连接时设置 WAL 等 PRAGMA，让管理写入不阻塞决策读取。
+    """
+    options = {"echo": DATABASE_ECHO}
+    is_sqlite = DATABASE_URL.startswith("sqlite")
+    if not (is_sqlite and ":memory:" in DATABASE_URL):
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+        if is_sqlite:
+            options["poolclass"] = AsyncAdaptedQueuePool
+    db_engine = create_async_engine(DATABASE_URL, **options)
+
+    if is_sqlite:
+        @event.listens_for(db_engine.sync_engine, "connect")
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+            cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+            cursor.close()
+
+    return db_engine
+
 
 # SQLAlchemy 配置
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = _create_engine()
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 Base = declarative_base()
 
@@ -21,17 +57,27 @@ Base = declarative_base()
 class GrayRuleDB(Base):
     """灰度规则数据库模型"""
     __tablename__ = "gray_rules"
+    __table_args__ = (
+        Index("ix_gray_rules_enabled_priority", "is_enabled", "priority"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), unique=True, nullable=False, comment="规则名称")
     description = Column(Text, nullable=True, comment="规则描述")
     is_enabled = Column(Boolean, default=True, comment="是否启用")
+    is_shadow = Column(Boolean, default=False, comment="影子规则：只统计假如上线后的命中，不影响路由")
     priority = Column(Integer, default=0, comment="优先级，数字越大优先级越高")
     
     # 匹配条件
-    match_type = Column(String(50), default="whitelist", comment="匹配类型: whitelist, header, cookie, ip")
-    match_key = Column(String(100), nullable=True, comment="匹配键名（如header名、cookie名）")
+    match_type = Column(String(50), default="whitelist", comment="匹配类型: whitelist, header, cookie, ip, percentage")
+    match_key = Column(String(100), nullable=True, comment="匹配键名（如header名、cookie名；percentage 类型为分桶键）")
     match_values = Column(JSON, default=list, comment="匹配值列表（白名单列表）")
+    rollout_percentage = Column(Float, nullable=True, comment="percentage 类型的放量比例（0-100）")
+    
+    # 生效时间窗口（UTC）与定时放量
+    active_from = Column(DateTime, nullable=True, comment="生效开始时间（UTC），为空表示立即生效")
+    active_until = Column(DateTime, nullable=True, comment="生效结束时间（UTC），为空表示一直有效")
+    rollout_steps = Column(JSON, nullable=True, comment="percentage 类型的定时放量步骤 [{at, percentage}]")
     
     # 灰度目标
     target_version = Column(String(50), default="gray", comment="目标版本标识")
@@ -45,6 +91,11 @@ class GrayRuleDB(Base):
 class WhitelistDB(Base):
     """白名单数据库模型"""
     __tablename__ = "whitelists"
+    __table_args__ = (
+        Index("ix_whitelists_rule_enabled", "rule_id", "is_enabled"),
+        Index("ix_whitelists_rule_created", "rule_id", "created_at"),
+        Index("uq_whitelists_rule_value", "rule_id", "value", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     rule_id = Column(Integer, nullable=False, comment="关联的规则ID")
@@ -55,44 +106,112 @@ class WhitelistDB(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class RuleChangeDB(Base):
+    """规则集变更日志，自增 id 即规则集版本号"""
+    __tablename__ = "rule_changes"
+    __table_args__ = {"sqlite_autoincrement": True}
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    rule_id = Column(Integer, nullable=False, index=True, comment="受影响的规则ID")
+    entity = Column(String(20), default="rule", comment="变更对象: rule, whitelist")
+    entity_id = Column(Integer, nullable=True, comment="变更对象ID，为空表示整条规则的白名单")
+    action = Column(String(20), default="update", comment="变更动作: create, update, delete, toggle")
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
 # ============== Pydantic 请求/响应模型 ==============
 
-class GrayRuleCreate(BaseModel):
+def _to_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """带时区的时间转换为 UTC 并去掉时区（数据库中统一保存 UTC 时间）；不带时区的按 UTC 处理"""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class RolloutStep(BaseModel):
+    """定时放量步骤：到达 at 时放量比例调整为 percentage"""
+    at: datetime
+    percentage: float = Field(..., ge=0, le=100)
+
+    _normalize_at = field_validator("at")(_to_utc)
+
+
+class ScheduleFields(BaseModel):
+    """规则的生效时间窗口与定时放量字段"""
+    active_from: Optional[datetime] = None
+    active_until: Optional[datetime] = None
+    rollout_steps: Optional[List[RolloutStep]] = None
+
+    _normalize_window = field_validator("active_from", "active_until")(_to_utc)
+
+    @field_validator("rollout_steps")
+    @classmethod
+    def _sort_steps(cls, steps: Optional[List[RolloutStep]]) -> Optional[List[RolloutStep]]:
+        return sorted(steps, key=lambda step: step.at) if steps else None
+
+    @model_validator(mode="after")
+    def _check_window(self):
+        if self.active_from and self.active_until and self.active_from >= self.active_until:
+            raise ValueError("active_until 必须晚于 active_from")
+        return self
+
+    @field_serializer("rollout_steps")
+    def _dump_steps(self, steps: Optional[List[RolloutStep]]) -> Optional[List[dict]]:
+        # JSON 列中保存 ISO 格式的时间
+        if not steps:
+            return None
+        return [{"at": step.at.isoformat(), "percentage": step.percentage} for step in steps]
+
+
+class GrayRuleCreate(ScheduleFields):
     """创建灰度规则请求"""
     name: str = Field(..., min_length=1, max_length=100)
     description: Optional[str] = None
     is_enabled: bool = True
+    is_shadow: bool = False
     priority: int = 0
     match_type: str = "whitelist"
     match_key: Optional[str] = None
     match_values: List[str] = []
+    rollout_percentage: Optional[float] = Field(None, ge=0, le=100)
     target_version: str = "gray"
     target_upstream: Optional[str] = None
 
+    @model_validator(mode="after")
+    def _check_rollout(self):
+        # 阶梯放量只调整百分比，其他匹配类型没有可放量的比例
+        if self.rollout_steps and self.match_type != "percentage":
+            raise ValueError("rollout_steps 仅适用于 percentage 规则")
+        return self
+
 
-class GrayRuleUpdate(BaseModel):
+class GrayRuleUpdate(ScheduleFields):
     """更新灰度规则请求"""
     name: Optional[str] = None
     description: Optional[str] = None
     is_enabled: Optional[bool] = None
+    is_shadow: Optional[bool] = None
     priority: Optional[int] = None
     match_type: Optional[str] = None
     match_key: Optional[str] = None
     match_values: Optional[List[str]] = None
+    rollout_percentage: Optional[float] = Field(None, ge=0, le=100)
     target_version: Optional[str] = None
     target_upstream: Optional[str] = None
 
 
-class GrayRuleResponse(BaseModel):
+class GrayRuleResponse(ScheduleFields):
     """灰度规则响应"""
     id: int
     name: str
     description: Optional[str]
     is_enabled: bool
+    is_shadow: bool = False
     priority: int
     match_type: str
     match_key: Optional[str]
     match_values: List[str]
+    rollout_percentage: Optional[float] = None
     target_version: str
     target_upstream: Optional[str]
     created_at: datetime
@@ -129,8 +248,8 @@ class GrayDecisionRequest(BaseModel):
     """灰度决策请求"""
     user_id: Optional[str] = None
     ip: Optional[str] = None
-    headers: Optional[dict] = None
-    cookies: Optional[dict] = None
+    headers: Optional[Dict[str, str]] = None
+    cookies: Optional[Dict[str, str]] = None
     path: Optional[str] = None
 
 
@@ -171,6 +290,61 @@ class ApiResponse(BaseModel, Generic[T]):
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_add_missing_indexes)
+
+
+def _add_missing_columns(conn):
+    """
+    为已有的表补齐新增的列（create_all 不会修改已存在的表）
+
+    新增列均为可空列；带数值/布尔默认值的列同时设置 DEFAULT，已有的行取默认值而不是 NULL。
+    """
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(conn.dialect)
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                default = column.default
+                if default is not None and default.is_scalar and isinstance(default.arg, (bool, int, float)):
+                    ddl += f" DEFAULT {int(default.arg) if isinstance(default.arg, bool) else default.arg}"
+                conn.execute(text(ddl))
+
+
+def _add_missing_indexes(conn):
+    """为已有的表补建索引；建唯一索引前先清理重复的白名单条目"""
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.name == "uq_whitelists_rule_value":
+                _dedupe_whitelists(conn)
+            index.create(conn)
+
+
+def _dedupe_whitelists(conn):
+    """同一规则下重复的值只保留一条（优先保留启用的、其次最早的），并记录变更让各 worker 重载白名单"""
+    duplicates = """
+        SELECT id, rule_id FROM (
+            SELECT id, rule_id, ROW_NUMBER() OVER (
+                PARTITION BY rule_id, value ORDER BY is_enabled DESC, id
+            ) AS position
+            FROM whitelists
+        ) WHERE position > 1
+    """
+    rule_ids = conn.execute(text(f"SELECT DISTINCT rule_id FROM ({duplicates})")).scalars().all()
+    if not rule_ids:
+        return
+    conn.execute(text(f"DELETE FROM whitelists WHERE id IN (SELECT id FROM ({duplicates}))"))
+    now = datetime.utcnow()
+    conn.execute(RuleChangeDB.__table__.insert(), [
+        {"rule_id": rule_id, "entity": "whitelist", "entity_id": None, "action": "update", "created_at": now}
+        for rule_id in rule_ids
+    ])
 
 
 async def get_session() -> AsyncSession:
@@ -1,11 +1,22 @@
 """管理 API 路由"""
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import select, delete
+from typing import AsyncIterator, List, Optional
+from datetime import datetime
+import base64
+import codecs
+import csv
+import io
+import json
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, delete, func, and_, or_, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from ..services.gray_service import rules_cache
+from ..services.decision_log import decision_log
+from ..services.gray_service import GrayService, record_rule_change
+from ..services.ip_index import parse_ip, parse_ip_range
 
 from ..models import (
+    async_session,
     get_session,
     GrayRuleDB, WhitelistDB,
     GrayRuleCreate, GrayRuleUpdate, GrayRuleResponse,
@@ -16,26 +27,69 @@ from ..models import (
 router = APIRouter(prefix="/admin", tags=["管理接口"])
 
 
+# ============== 游标分页 ==============
+
+def _encode_cursor(*values) -> str:
+    """把排序键编码为不透明游标"""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, *types) -> Optional[list]:
+    """解码游标并按 types 转换各排序键（datetime 从 ISO 字符串解析），无效时返回 None"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(types):
+            return None
+        return [
+            datetime.fromisoformat(v) if t is datetime else t(v)
+            for t, v in zip(types, values)
+        ]
+    except (ValueError, TypeError):
+        return None
+
+
 # ============== 灰度规则管理 ==============
 
 @router.get("/rules")
 async def list_rules(
     session: AsyncSession = Depends(get_session),
-    skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
     is_enabled: Optional[bool] = None
 ):
-    """获取规则列表"""
-    query = select(GrayRuleDB).order_by(GrayRuleDB.priority.desc())
+    """
+    获取规则列表
+
+    按优先级降序、ID 升序做游标分页：返回 items 和 next_cursor，next_cursor 为空表示没有下一页。
+    """
+    query = select(GrayRuleDB).order_by(GrayRuleDB.priority.desc(), GrayRuleDB.id)
     
     if is_enabled is not None:
         query = query.where(GrayRuleDB.is_enabled == is_enabled)
     
-    query = query.offset(skip).limit(limit)
-    result = await session.execute(query)
+    if cursor:
+        position = _decode_cursor(cursor, int, int)
+        if position is None:
+            return ApiResponse.error(message="无效的分页游标")
+        priority, rule_id = position
+        query = query.where(or_(
+            GrayRuleDB.priority < priority,
+            and_(GrayRuleDB.priority == priority, GrayRuleDB.id > rule_id),
+        ))
+    
+    result = await session.execute(query.limit(limit + 1))
     rules = result.scalars().all()
-    
-    return ApiResponse.success(data=[GrayRuleResponse.model_validate(r) for r in rules])
+    next_cursor = None
+    if len(rules) > limit:
+        rules = rules[:limit]
+        next_cursor = _encode_cursor(rules[-1].priority, rules[-1].id)
+    
+    return ApiResponse.success(data={
+        "items": [GrayRuleResponse.model_validate(r) for r in rules],
+        "next_cursor": next_cursor,
+    })
 
 
 @router.post("/rules")
@@ -53,10 +107,12 @@ async def create_rule(
     
     db_rule = GrayRuleDB(**rule.model_dump())
     session.add(db_rule)
+    await session.flush()
+    await record_rule_change(session, db_rule.id, action="create")
     await session.commit()
     await session.refresh(db_rule)
     
-    rules_cache.clear() # 清除缓存
+    await GrayService(session).sync_rules_cache()  # 增量同步缓存
     return ApiResponse.success(data=GrayRuleResponse.model_validate(db_rule))
 
 
@@ -96,11 +152,16 @@ async def update_rule(
     update_data = rule_update.model_dump(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_rule, key, value)
+    if db_rule.active_from and db_rule.active_until and db_rule.active_from >= db_rule.active_until:
+        return ApiResponse.error(message="active_until 必须晚于 active_from")
+    if db_rule.rollout_steps and db_rule.match_type != "percentage":
+        return ApiResponse.error(message="rollout_steps 仅适用于 percentage 规则")
     
+    await record_rule_change(session, rule_id, action="update")
     await session.commit()
     await session.refresh(db_rule)
     
-    rules_cache.clear() # 清除缓存
+    await GrayService(session).sync_rules_cache()  # 增量同步缓存
     return ApiResponse.success(data=GrayRuleResponse.model_validate(db_rule))
 
 
@@ -124,9 +185,10 @@ async def delete_rule(
     )
     
     await session.delete(db_rule)
+    await record_rule_change(session, rule_id, action="delete")
     await session.commit()
     
-    rules_cache.clear() # 清除缓存
+    await GrayService(session).sync_rules_cache()  # 增量同步缓存
     return ApiResponse.success(data={"id": rule_id}, message="删除成功")
 
 
@@ -145,9 +207,10 @@ async def toggle_rule(
         return ApiResponse.error(message="规则不存在")
     
     db_rule.is_enabled = not db_rule.is_enabled
+    await record_rule_change(session, rule_id, action="toggle")
     await session.commit()
     
-    rules_cache.clear() # 清除缓存
+    await GrayService(session).sync_rules_cache()  # 增量同步缓存
     return ApiResponse.success(data={"is_enabled": db_rule.is_enabled}, message="状态已切换")
 
 
@@ -156,17 +219,93 @@ async def toggle_rule(
 @router.get("/rules/{rule_id}/whitelist")
 async def list_whitelist(
     rule_id: int,
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(get_session),
+    limit: int = Query(200, ge=1, le=1000),
+    cursor: Optional[str] = None
 ):
-    """获取规则的白名单列表"""
-    result = await session.execute(
+    """
+    获取规则的白名单列表
+
+    按 (created_at, id) 降序做游标分页，返回 items、next_cursor 以及条目总数 total。
+    完整名单请使用 /rules/{rule_id}/whitelist/export。
+    """
+    query = (
         select(WhitelistDB)
         .where(WhitelistDB.rule_id == rule_id)
-        .order_by(WhitelistDB.created_at.desc())
+        .order_by(WhitelistDB.created_at.desc(), WhitelistDB.id.desc())
     )
+    if cursor:
+        position = _decode_cursor(cursor, datetime, int)
+        if position is None:
+            return ApiResponse.error(message="无效的分页游标")
+        query = query.where(tuple_(WhitelistDB.created_at, WhitelistDB.id) < tuple_(*position))
+    
+    result = await session.execute(query.limit(limit + 1))
     whitelists = result.scalars().all()
+    next_cursor = None
+    if len(whitelists) > limit:
+        whitelists = whitelists[:limit]
+        next_cursor = _encode_cursor(whitelists[-1].created_at, whitelists[-1].id)
     
-    return ApiResponse.success(data=[WhitelistResponse.model_validate(w) for w in whitelists])
+    total = await session.scalar(
+        select(func.count()).select_from(WhitelistDB).where(WhitelistDB.rule_id == rule_id)
+    )
+    return ApiResponse.success(data={
+        "items": [WhitelistResponse.model_validate(w) for w in whitelists],
+        "next_cursor": next_cursor,
+        "total": total,
+    })
+
+
+_EXPORT_COLUMNS = ("id", "value", "value_type", "remark", "is_enabled", "created_at")
+
+
+async def _export_whitelist_rows(rule_id: int, fmt: str, chunk_size: int = 1000) -> AsyncIterator[str]:
+    """服务端游标逐块读取白名单并编码为 CSV / NDJSON（响应流式返回期间使用独立会话）"""
+    columns = [getattr(WhitelistDB, name) for name in _EXPORT_COLUMNS]
+    if fmt == "csv":
+        yield ",".join(_EXPORT_COLUMNS) + "\n"
+    async with async_session() as session:
+        result = await session.stream(
+            select(*columns)
+            .where(WhitelistDB.rule_id == rule_id)
+            .order_by(WhitelistDB.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        async for rows in result.partitions(chunk_size):
+            if fmt == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer, lineterminator="\n")
+                for row in rows:
+                    writer.writerow([
+                        v.isoformat() if isinstance(v, datetime) else "" if v is None else v for v in row
+                    ])
+                yield buffer.getvalue()
+            else:
+                yield "".join(
+                    json.dumps(
+                        {k: v.isoformat() if isinstance(v, datetime) else v for k, v in zip(_EXPORT_COLUMNS, row)},
+                        ensure_ascii=False,
+                    ) + "\n"
+                    for row in rows
+                )
+
+
+@router.get("/rules/{rule_id}/whitelist/export")
+async def export_whitelist(
+    rule_id: int,
+    format: str = Query("csv", pattern="^(csv|ndjson)$")
+):
+    """导出规则的完整白名单（CSV / NDJSON 流式输出，不在内存中组装整个名单）"""
+    if format == "csv":
+        media_type = "text/csv"
+    else:
+        media_type = "application/x-ndjson"
+    return StreamingResponse(
+        _export_whitelist_rows(rule_id, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="whitelist_{rule_id}.{format}"'},
+    )
 
 
 @router.post("/whitelist")
@@ -193,12 +332,117 @@ async def add_whitelist(
     
     db_whitelist = WhitelistDB(**whitelist.model_dump())
     session.add(db_whitelist)
+    await session.flush()
+    await record_rule_change(session, whitelist.rule_id, "whitelist", db_whitelist.id, "create")
     await session.commit()
     await session.refresh(db_whitelist)
     
+    await GrayService(session).sync_rules_cache()  # 增量同步缓存
     return ApiResponse.success(data=WhitelistResponse.model_validate(db_whitelist))
 
 
+class _WhitelistImport:
+    """
+    白名单批量导入
+
+    规则已有的值一次查询载入内存去重；读取请求体期间只在内存中收集新条目，不持有数据库事务，
+    读完后在一个短事务中按块 executemany 插入（与并发写入冲突的值跳过）。
+    缓冲区只保存值字符串，插入参数在每个块内临时构造，百万级导入时内存占用与值本身相当；
+    整个导入只记录一次规则变更（缓存整体重载该规则的白名单）。
+    """
+    CHUNK_SIZE = 5000
+    MAX_LENGTH = 200
+
+    def __init__(self, session: AsyncSession, rule_id: int, value_type: str):
+        self.session = session
+        self.rule_id = rule_id
+        self.value_type = value_type
+        self.seen: set = set()
+        self.values: List[str] = []  # 待插入的新值
+        self.added = 0
+        self.skipped = 0
+        self.invalid = 0
+
+    async def load_existing(self):
+        result = await self.session.execute(
+            select(WhitelistDB.value).where(WhitelistDB.rule_id == self.rule_id)
+        )
+        self.seen = set(result.scalars())
+        # 结束读事务：上传可能持续很久，期间不占用连接，也不让后续写入因快照过期而失败
+        await self.session.commit()
+
+    def is_valid(self, value: str) -> bool:
+        if len(value) > self.MAX_LENGTH:
+            return False
+        if self.value_type == "ip":
+            return parse_ip(value) is not None or parse_ip_range(value) is not None
+        return True
+
+    def add(self, value: str):
+        value = value.strip()
+        if not value:
+            return
+        if not self.is_valid(value):
+            self.invalid += 1
+            return
+        if value in self.seen:
+            self.skipped += 1
+            return
+        self.seen.add(value)
+        self.values.append(value)
+
+    def _chunk_rows(self, values: List[str]) -> List[dict]:
+        return [
+            {"rule_id": self.rule_id, "value": value, "value_type": self.value_type, "is_enabled": True}
+            for value in values
+        ]
+
+    async def finish(self) -> dict:
+        statement = sqlite_insert(WhitelistDB.__table__).on_conflict_do_nothing(index_elements=["rule_id", "value"])
+        for start in range(0, len(self.values), self.CHUNK_SIZE):
+            rows = self._chunk_rows(self.values[start:start + self.CHUNK_SIZE])
+            result = await self.session.execute(statement, rows)
+            self.added += result.rowcount
+        self.skipped += len(self.values) - self.added
+        self.values = []
+        if self.added:
+            await record_rule_change(self.session, self.rule_id, "whitelist", None, "create")
+        await self.session.commit()
+        await GrayService(self.session).sync_rules_cache()  # 增量同步缓存
+        return {"added": self.added, "skipped": self.skipped, "invalid": self.invalid}
+
+
+async def _iter_upload_values(request: Request, is_csv: bool) -> AsyncIterator[str]:
+    """流式读取上传内容：每行一个值，CSV 取第一列（首行为 value 表头时跳过）"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    buffer = ""
+    first = True
+    async for chunk in request.stream():
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            value = _upload_value(line, is_csv, first)
+            first = False
+            if value is not None:
+                yield value
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        value = _upload_value(buffer, is_csv, first)
+        if value is not None:
+            yield value
+
+
+def _upload_value(line: str, is_csv: bool, first: bool) -> Optional[str]:
+    if not is_csv:
+        return line
+    fields = next(csv.reader([line]), None)
+    if not fields:
+        return None
+    if first and fields[0].strip().lower() == "value":
+        return None
+    return fields[0]
+
+
 @router.post("/whitelist/batch")
 async def batch_add_whitelist(
     rule_id: int,
@@ -214,36 +458,39 @@ async def batch_add_whitelist(
     if not rule_result.scalar_one_or_none():
         return ApiResponse.error(message="规则不存在")
     
-    added = 0
-    skipped = 0
-    
+    importer = _WhitelistImport(session, rule_id, value_type)
+    await importer.load_existing()
     for value in values:
-        value = value.strip()
-        if not value:
-            continue
-            
-        # 检查是否已存在
-        existing = await session.execute(
-            select(WhitelistDB)
-            .where(WhitelistDB.rule_id == rule_id)
-            .where(WhitelistDB.value == value)
-        )
-        if existing.scalar_one_or_none():
-            skipped += 1
-            continue
-        
-        db_whitelist = WhitelistDB(
-            rule_id=rule_id,
-            value=value,
-            value_type=value_type,
-            is_enabled=True
-        )
-        session.add(db_whitelist)
-        added += 1
-    
-    await session.commit()
-    
-    return ApiResponse.success(data={"added": added, "skipped": skipped}, message="批量添加完成")
+        importer.add(value)
+    return ApiResponse.success(data=await importer.finish(), message="批量添加完成")
+
+
+@router.post("/whitelist/import")
+async def import_whitelist(
+    rule_id: int,
+    request: Request,
+    value_type: str = "user_id",
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    导入白名单（大文件）
+
+    请求体为纯文本（每行一个值）或 CSV（Content-Type: text/csv，取第一列），流式读取、逐行去重，
+    只保留新条目；上传结束后才在一个短事务中写入，上传期间不阻塞其他管理写操作。
+    返回新增 / 已存在跳过 / 无效（超长、ip 类型无法解析）的条目数。
+    """
+    rule_result = await session.execute(
+        select(GrayRuleDB).where(GrayRuleDB.id == rule_id)
+    )
+    if not rule_result.scalar_one_or_none():
+        return ApiResponse.error(message="规则不存在")
+
+    is_csv = "csv" in request.headers.get("content-type", "")
+    importer = _WhitelistImport(session, rule_id, value_type)
+    await importer.load_existing()
+    async for value in _iter_upload_values(request, is_csv):
+        importer.add(value)
+    return ApiResponse.success(data=await importer.finish(), message="导入完成")
 
 
 @router.delete("/whitelist/{whitelist_id}")
@@ -261,8 +508,10 @@ async def delete_whitelist(
         return ApiResponse.error(message="白名单条目不存在")
     
     await session.delete(db_whitelist)
+    await record_rule_change(session, db_whitelist.rule_id, "whitelist", whitelist_id, "delete")
     await session.commit()
     
+    await GrayService(session).sync_rules_cache()  # 增量同步缓存
     return ApiResponse.success(data={"id": whitelist_id}, message="删除成功")
 
 
@@ -281,7 +530,31 @@ async def toggle_whitelist(
         return ApiResponse.error(message="白名单条目不存在")
     
     db_whitelist.is_enabled = not db_whitelist.is_enabled
+    await record_rule_change(session, db_whitelist.rule_id, "whitelist", whitelist_id, "toggle")
     await session.commit()
     
+    await GrayService(session).sync_rules_cache()  # 增量同步缓存
     return ApiResponse.success(data={"is_enabled": db_whitelist.is_enabled}, message="状态已切换")
 
+
+
+# ============== 决策审计日志 ==============
+
+@router.get("/decisions")
+async def list_decisions(
+    user_id: Optional[str] = None,
+    ip: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=1000),
+):
+    """
+    查询最近的灰度决策（需开启 DECISION_LOG_ENABLED）
+
+    按用户ID和/或 IP 过滤，按时间倒序返回命中的规则与当时的规则集版本。
+    其他 worker 缓冲区中的记录最多延迟 DECISION_LOG_FLUSH_INTERVAL 秒可见。
+    """
+    if not decision_log.enabled:
+        return ApiResponse.error(message="决策日志未开启")
+    if user_id is None and ip is None:
+        return ApiResponse.error(message="请指定 user_id 或 ip")
+    items = await decision_log.query(user_id, ip, limit)
+    return ApiResponse.success(data={"items": items, "stats": decision_log.stats()})
@@ -0,0 +1,122 @@
+"""Nginx auth_request 快速通道（原生 ASGI）
+
+auth_request 只关心状态码和响应头，/gray/auth 的 Pydantic 模型、整份 header/cookie 拷贝
+和 ApiResponse 响应体都会被 Nginx 丢弃。这里绕过 FastAPI 的路由依赖与序列化：
+
+- 只读取编译计划实际引用的 header 和 cookie；
+- 直接返回空的 200 响应，决策结果放在 X-Gray-* 响应头；
+- 规则缓存已加载时不创建数据库会话。
+"""
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+from ..services.decision_cache import decision_cache
+from ..services.decision_log import decision_log
+from ..services.decision_plan import DecisionInput, DecisionPlan
+from ..services.gray_service import ensure_plan
+from ..services.shadow import shadow_evaluator
+from ..services.ip_index import extract_client_ip
+
+Headers = List[Tuple[bytes, bytes]]
+
+_STABLE_HEADERS: Headers = [
+    (b"content-length", b"0"),
+    (b"x-gray-target", b"stable"),
+    (b"x-gray-reason", b"No rule matched, default to stable"),
+]
+
+
+def _header_value(value: str) -> bytes:
+    # 规则名等可能包含中文，响应头只能是 latin-1，非 ASCII 字符做 URL 编码
+    return quote(value, safe=" !#$&'()*+,-./:;=?@[]^_`{|}~").encode("latin-1")
+
+
+def _rule_headers(rule) -> Headers:
+    headers = [
+        (b"content-length", b"0"),
+        (b"x-gray-target", _header_value(rule.target_version)),
+    ]
+    if rule.target_upstream:
+        headers.append((b"x-gray-upstream", _header_value(rule.target_upstream)))
+    headers.append((b"x-gray-matched", _header_value(rule.name)))
+    headers.append((b"x-gray-reason", _header_value(rule.reason)))
+    return headers
+
+
+def _parse_cookies(cookie_header: str, names: frozenset) -> dict:
+    """只解析规则引用到的 cookie"""
+    cookies = {}
+    for item in cookie_header.split(";"):
+        name, sep, value = item.partition("=")
+        if not sep:
+            continue
+        name = name.strip()
+        if name in names:
+            cookies[name] = value.strip().strip('"')
+    return cookies
+
+
+def read_decision_input(scope, plan: DecisionPlan, cookie_names: Optional[frozenset] = None) -> DecisionInput:
+    """从 ASGI scope 中提取决策所需的最少请求属性（cookie_names 默认为计划引用的 cookie）"""
+    header_keys = plan.header_keys
+    if cookie_names is None:
+        cookie_names = plan.cookie_names
+    user_id = real_ip = forwarded_for = cookie_header = None
+    headers = {}
+    for raw_name, raw_value in scope["headers"]:
+        name = raw_name.decode("latin-1")
+        if name == "x-user-id":
+            user_id = raw_value.decode("latin-1")
+        elif name == "x-real-ip":
+            real_ip = raw_value.decode("latin-1")
+        elif name == "x-forwarded-for":
+            forwarded_for = raw_value.decode("latin-1")
+        elif name == "cookie":
+            cookie_header = raw_value.decode("latin-1")
+        if name in header_keys:
+            headers[name] = raw_value.decode("latin-1")
+
+    cookies = _parse_cookies(cookie_header, cookie_names) if cookie_header and cookie_names else {}
+    return DecisionInput(user_id or None, extract_client_ip(real_ip, forwarded_for), headers, cookies)
+
+
+class FastAuthApp:
+    """auth_request 快速通道 ASGI 应用"""
+
+    def __init__(self):
+        # 按计划缓存每条规则的响应头，计划不变时请求路径上不再拼装
+        self._plan: Optional[DecisionPlan] = None
+        self._input_plan: Optional[DecisionPlan] = None  # 决定读取哪些请求属性（有影子规则时为影子计划）
+        self._headers: dict = {}
+
+    def bind(self, plan: DecisionPlan):
+        if plan is not self._plan:
+            self._plan = plan
+            self._input_plan = plan.shadow or plan
+            self._headers = {}
+
+    def response_headers(self, rule) -> Headers:
+        if rule is None:
+            return _STABLE_HEADERS
+        headers = self._headers.get(rule.id)
+        if headers is None:
+            headers = self._headers[rule.id] = _rule_headers(rule)
+        return headers
+
+    async def __call__(self, scope, receive, send):
+        plan = await ensure_plan()
+        self.bind(plan)
+        inp = read_decision_input(scope, self._input_plan)
+        rule = decision_cache.evaluate(plan, inp)
+        headers = self.response_headers(rule)
+        decision_log.record(plan, inp, rule, "fast-auth")
+        shadow_evaluator.submit(plan, inp, rule, "fast-auth")
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": headers,
+        })
+        await send({"type": "http.response.body", "body": b""})
+
+
+fast_auth_app = FastAuthApp()
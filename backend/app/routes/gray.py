@@ -1,10 +1,14 @@
 """灰度决策 API 路由"""
 from typing import Optional
+import json
 from fastapi import APIRouter, Depends, Header, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..models import get_session, GrayDecisionRequest, GrayDecisionResponse, ApiResponse
-from ..services.gray_service import GrayService
+from ..services.gray_service import GrayService, rules_cache
+from ..services.decision_cache import decision_cache
+from ..services.ip_index import extract_client_ip
 
 router = APIRouter(prefix="/gray", tags=["灰度决策"])
 
@@ -24,6 +28,63 @@ async def decide_gray(
     return ApiResponse.success(data=decision)
 
 
+def _ndjson_items(body: bytes):
+    """逐行解析 NDJSON，无法解析的行交给批量决策报告为无效"""
+    for line in body.splitlines():
+        if line.strip():
+            yield _parse_line(line)
+
+
+def _parse_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+async def _ndjson_lines(results, chunk_size: int = 1000):
+    """结果按块拼成 NDJSON，减少流式响应的写入次数"""
+    lines = []
+    async for result in results:
+        lines.append(json.dumps(result, ensure_ascii=False))
+        if len(lines) >= chunk_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+@router.post("/decide/batch")
+async def decide_gray_batch(
+    request: Request,
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    批量灰度决策接口
+
+    请求体为 GrayDecisionRequest 的 JSON 数组，或 NDJSON（Content-Type: application/x-ndjson，每行一个请求）。
+    整批请求使用同一份规则集快照，结果以 NDJSON 流式返回：
+    每行 `{"index", "user_id", "should_gray", "target_version", "target_upstream", "matched_rule"}`，
+    无效条目为 `{"index", "error"}`，最后一行为 `{"summary": {...}}`，包含规则集版本和每条规则的命中次数。
+    输出是流式的，输入不是：请求体（包括 NDJSON）会先完整读入内存再开始决策。
+    """
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        # 响应流式返回期间 Starlette 会占用 receive 监听断连，请求体需在返回前读完
+        items = _ndjson_items(await request.body())
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            return ApiResponse.error(message="请求体不是合法的 JSON")
+        if not isinstance(body, list):
+            return ApiResponse.error(message="请求体应为决策请求数组或 NDJSON")
+        items = body
+
+    results = await GrayService(session).decide_batch(items)
+    return StreamingResponse(_ndjson_lines(results), media_type="application/x-ndjson")
+
+
 @router.get("/auth")
 async def nginx_auth_request(
     request: Request,
@@ -57,8 +118,8 @@ async def nginx_auth_request(
     }
     ```
     """
-    # 提取客户端 IP
-    client_ip = x_real_ip or (x_forwarded_for.split(",")[0].strip() if x_forwarded_for else None)
+    # 提取客户端 IP（X-Real-IP 优先，其次 X-Forwarded-For 中第一个合法地址）
+    client_ip = extract_client_ip(x_real_ip, x_forwarded_for)
     
     # 提取所有请求头
     headers_dict = dict(request.headers)
@@ -77,7 +138,7 @@ async def nginx_auth_request(
     
     # 获取决策结果
     service = GrayService(session)
-    decision = await service.make_decision(decision_request)
+    decision = await service.make_decision(decision_request, source="auth")
 
     # 设置响应头供 Nginx 使用
     response.headers["X-Gray-Target"] = decision.target_version
@@ -93,6 +154,20 @@ async def nginx_auth_request(
 
 @router.get("/health")
 async def health_check():
-    """健康检查接口"""
-    return ApiResponse.success(data={"status": "healthy", "service": "gray-release-bff"})
+    """
+    健康检查接口
+
+    ready 表示本 worker 已加载并编译规则集（启动预热完成），rule_set_version 为已加载的版本，
+    source 为整体加载的来源（database / snapshot）。
+    """
+    plan = rules_cache.get_plan()
+    return ApiResponse.success(data={
+        "status": "healthy" if plan is not None else "warming",
+        "service": "gray-release-bff",
+        "ready": plan is not None,
+        "rule_set_version": plan.version if plan is not None else None,
+        "rules": len(plan.rules) if plan is not None else 0,
+        "source": rules_cache.source,
+        "decision_cache": decision_cache.stats(),
+    })
 
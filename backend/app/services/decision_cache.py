@@ -0,0 +1,93 @@
+"""决策结果缓存
+
+同一用户反复刷新页面时，auth_request 的输入几乎不变。
+按 DecisionPlan.fingerprint（只包含当前规则集实际读取的请求属性）缓存命中的规则，
+缓存项有 TTL 上限，计划对象变化（规则集版本前进）时整体失效。
+计划只包含倒排索引可判定的规则（白名单、header、IP）时，直接匹配比计算指纹、查缓存更快，不经过缓存。
+决策耗时按命中/未命中/直接匹配分别计入 gray_decision_duration_seconds。
+"""
+from collections import OrderedDict
+from typing import Optional
+import time
+
+from config import DECISION_CACHE_SIZE, DECISION_CACHE_TTL
+from .decision_plan import CompiledRule, DecisionInput, DecisionPlan
+from .metrics import count_decision, decision_duration, registry
+
+_hit_duration = decision_duration.labels("hit")
+_miss_duration = decision_duration.labels("miss")
+_direct_duration = decision_duration.labels("direct")
+
+
+class DecisionCache:
+    """有界 LRU + TTL 的决策缓存"""
+
+    def __init__(self, maxsize: int = 50000, ttl: float = 30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._plan: Optional[DecisionPlan] = None
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def evaluate(self, plan: DecisionPlan, inp: DecisionInput) -> Optional[CompiledRule]:
+        """带缓存的 plan.evaluate"""
+        started = time.perf_counter()
+        if self.maxsize <= 0 or not plan.cacheable:
+            rule = plan.evaluate(inp)
+            _direct_duration.observe(time.perf_counter() - started)
+            count_decision(rule)
+            return rule
+        entries = self._entries
+        if plan is not self._plan:
+            entries.clear()
+            self._plan = plan
+
+        key = plan.fingerprint(inp)
+        now = time.monotonic()
+        entry = entries.get(key)
+        if entry is not None and entry[1] > now:
+            self.hits += 1
+            entries.move_to_end(key)
+            _hit_duration.observe(time.perf_counter() - started)
+            count_decision(entry[0])
+            return entry[0]
+
+        self.misses += 1
+        rule = plan.evaluate(inp)
+        entries[key] = (rule, now + self.ttl)
+        entries.move_to_end(key)
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+            self.evictions += 1
+        _miss_duration.observe(time.perf_counter() - started)
+        count_decision(rule)
+        return rule
+
+    def clear(self):
+        self._entries.clear()
+        self._plan = None
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+# 全局缓存实例
+decision_cache = DecisionCache(DECISION_CACHE_SIZE, DECISION_CACHE_TTL)
+
+registry.callback("gray_decision_cache_entries", "决策缓存当前条目数", lambda: len(decision_cache._entries))
+registry.callback("gray_decision_cache_hits_total", "决策缓存命中次数", lambda: decision_cache.hits, "counter")
+registry.callback("gray_decision_cache_misses_total", "决策缓存未命中次数", lambda: decision_cache.misses, "counter")
+registry.callback(
+    "gray_decision_cache_evictions_total", "决策缓存因容量淘汰的条目数", lambda: decision_cache.evictions, "counter"
+)
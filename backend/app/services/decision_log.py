@@ -0,0 +1,215 @@
+"""决策审计日志（异步批量写入）
+
+记录每次决策命中的规则与规则集版本，用于事后排查“某个用户为什么进了灰度”。
+请求路径上只做一次采样判断和一次 deque 追加；后台任务按批把缓冲区写入独立的 SQLite 文件，
+不占用业务库的写锁。
+
+- 采样：有用户ID时按用户ID哈希采样（被采中的用户每次决策都会记录，便于完整追溯），
+  否则随机采样；
+- 背压：缓冲区满时丢弃新记录并计数，决策请求永远不会因为日志而等待；
+- 保留：超过 DECISION_LOG_RETENTION_DAYS 天的记录在后台定期删除。
+"""
+from collections import deque
+from datetime import datetime
+from typing import List, Optional
+import asyncio
+import os
+import random
+import sqlite3
+import time
+import zlib
+
+from config import (
+    DECISION_LOG_ENABLED, DECISION_LOG_PATH, DECISION_LOG_SAMPLE_RATE, DECISION_LOG_BUFFER_SIZE,
+    DECISION_LOG_BATCH_SIZE, DECISION_LOG_RETENTION_DAYS,
+)
+from .decision_plan import CompiledRule, DecisionInput, DecisionPlan
+from .metrics import registry
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS decisions (
+        id INTEGER PRIMARY KEY,
+        ts REAL NOT NULL,
+        user_id TEXT,
+        ip TEXT,
+        rule_id INTEGER,
+        rule_name TEXT,
+        target_version TEXT NOT NULL,
+        rule_set_version INTEGER NOT NULL,
+        source TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_decisions_user_ts ON decisions (user_id, ts)",
+    "CREATE INDEX IF NOT EXISTS ix_decisions_ts ON decisions (ts)",
+)
+_COLUMNS = ("ts", "user_id", "ip", "rule_id", "rule_name", "target_version", "rule_set_version", "source")
+_INSERT = f"INSERT INTO decisions ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})"
+_PRUNE_INTERVAL = 3600  # 秒
+
+
+class DecisionLog:
+    """环形缓冲 + 后台批量写入的决策日志"""
+
+    def __init__(
+        self,
+        path: str,
+        enabled: bool = False,
+        sample_rate: float = 1.0,
+        buffer_size: int = 100000,
+        batch_size: int = 1000,
+        retention_days: float = 7,
+    ):
+        self.path = path
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.retention_days = retention_days
+        self._threshold = int(sample_rate * 0x100000000)  # crc32 取值范围内的采样阈值
+        self._buffer: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()  # 串行化写入与查询（共用一个连接）
+        self._conn: Optional[sqlite3.Connection] = None
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.write_errors = 0
+
+    def sampled(self, user_id: Optional[str]) -> bool:
+        if self.sample_rate >= 1:
+            return True
+        if user_id:
+            return zlib.crc32(user_id.encode()) < self._threshold
+        return random.random() < self.sample_rate
+
+    def record(self, plan: DecisionPlan, inp: DecisionInput, rule: Optional[CompiledRule], source: str):
+        """在请求路径上调用：采样后放入缓冲区，缓冲区满时丢弃"""
+        if not self.enabled or not self.sampled(inp.user_id):
+            return
+        buffer = self._buffer
+        if len(buffer) >= self.buffer_size:
+            self.dropped += 1
+            return
+        if rule is None:
+            buffer.append((time.time(), inp.user_id, inp.ip, None, None, "stable", plan.version, source))
+        else:
+            buffer.append((time.time(), inp.user_id, inp.ip, rule.id, rule.name, rule.target_version, plan.version, source))
+        self.recorded += 1
+        if len(buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    # ===== 存储 =====
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _write(self, rows: List[tuple]):
+        conn = self._connect()
+        with conn:
+            conn.executemany(_INSERT, rows)
+
+    def _prune(self, before: float):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM decisions WHERE ts < ?", (before,))
+
+    def _query(self, user_id: Optional[str], ip: Optional[str], limit: int) -> List[tuple]:
+        conditions, params = [], []
+        if user_id is not None:
+            conditions.append("user_id = ?")
+            params.append(user_id)
+        if ip is not None:
+            conditions.append("ip = ?")
+            params.append(ip)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self._connect().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM decisions {where} ORDER BY ts DESC LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+
+    async def flush(self):
+        """把缓冲区按批写入磁盘"""
+        async with self._lock:
+            buffer = self._buffer
+            while buffer:
+                rows = [buffer.popleft() for _ in range(min(self.batch_size, len(buffer)))]
+                try:
+                    await asyncio.to_thread(self._write, rows)
+                    self.written += len(rows)
+                except sqlite3.Error as exc:
+                    # 写入失败不重试，避免磁盘问题时缓冲区无限堆积
+                    self.write_errors += len(rows)
+                    print(f"⚠️ Decision log write failed: {exc}")
+
+    async def query(self, user_id: Optional[str] = None, ip: Optional[str] = None, limit: int = 50) -> List[dict]:
+        """按用户ID / IP 查询最近的决策（先写入缓冲区中尚未落盘的记录）"""
+        await self.flush()
+        async with self._lock:
+            rows = await asyncio.to_thread(self._query, user_id, ip, limit)
+        items = []
+        for row in rows:
+            item = dict(zip(_COLUMNS, row))
+            item["ts"] = datetime.utcfromtimestamp(item["ts"]).isoformat()
+            items.append(item)
+        return items
+
+    async def run(self, interval: float):
+        """后台写入任务：每 interval 秒或缓冲区积满一批时写入"""
+        last_prune = 0.0
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+                if self.retention_days > 0 and time.monotonic() - last_prune > _PRUNE_INTERVAL:
+                    last_prune = time.monotonic()
+                    async with self._lock:
+                        await asyncio.to_thread(self._prune, time.time() - self.retention_days * 86400)
+        finally:
+            # 关闭时尽量写完缓冲区
+            await asyncio.shield(self.flush())
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "buffered": len(self._buffer),
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "written": self.written,
+            "write_errors": self.write_errors,
+        }
+
+
+# 全局实例
+decision_log = DecisionLog(
+    DECISION_LOG_PATH,
+    enabled=DECISION_LOG_ENABLED,
+    sample_rate=DECISION_LOG_SAMPLE_RATE,
+    buffer_size=DECISION_LOG_BUFFER_SIZE,
+    batch_size=DECISION_LOG_BATCH_SIZE,
+    retention_days=DECISION_LOG_RETENTION_DAYS,
+)
+
+registry.callback("gray_decision_log_buffered", "决策日志缓冲区中待写入的记录数", lambda: len(decision_log._buffer))
+registry.callback("gray_decision_log_recorded_total", "进入决策日志缓冲区的记录数", lambda: decision_log.recorded, "counter")
+registry.callback("gray_decision_log_dropped_total", "缓冲区满而丢弃的记录数", lambda: decision_log.dropped, "counter")
+registry.callback("gray_decision_log_written_total", "已写入磁盘的记录数", lambda: decision_log.written, "counter")
+registry.callback(
+    "gray_decision_log_write_errors_total", "写入失败而丢弃的记录数", lambda: decision_log.write_errors, "counter"
+)
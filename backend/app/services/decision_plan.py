@@ -0,0 +1,568 @@
+"""编译后的灰度决策计划
+
+启用的规则在规则集版本变化时编译一次，生成不可变的匹配器序列；
+决策时同步执行，不再逐条遍历 ORM 对象、也不再按 match_type 字符串分发。
+
+值可枚举的规则（进程内 frozenset）再汇总成倒排索引：(维度, 值) -> 命中规则在计划中的位置，
+一次请求只需按维度做几次 dict 查找即可得到优先级最高的命中；
+值不可枚举的规则（快照承载）作为剩余规则按顺序检查，且只检查排在当前最优命中之前的部分。
+
+带生效时间窗口或定时放量的规则在编译时展开成时间线：每个区间各有一份决策计划，
+计划之间按区间先后串成链表。决策时只需把当前时间与本区间的结束时间比较一次，
+到点后切换到下一份预先编译好的计划，不解析时间、也不写数据库。
+"""
+from datetime import datetime, timezone
+from typing import Optional, Dict, Iterable, List, Tuple
+import copy
+import math
+import time
+import zlib
+
+from ..models import GrayDecisionRequest
+from .ip_index import IpPrefixTrie, normalize_ip, parse_ip, parse_ip_range
+from .jwt_identity import decode_jwt_identities
+
+_UNPARSED = object()
+_FOREVER = float("inf")
+
+
+def _timestamp(value) -> float:
+    """数据库中的 UTC 时间（datetime 或 JSON 中的 ISO 字符串）转换为时间戳"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class DecisionInput:
+    """决策输入（已归一化的请求属性）"""
+    __slots__ = ("user_id", "ip", "headers", "cookies", "_address", "_identities")
+
+    def __init__(
+        self,
+        user_id: Optional[str] = None,
+        ip: Optional[str] = None,
+        headers: Optional[dict] = None,
+        cookies: Optional[dict] = None,
+    ):
+        self.user_id = user_id
+        self.ip = ip
+        self.headers = headers or {}  # 键统一为小写
+        self.cookies = cookies or {}
+        self._address = _UNPARSED
+        self._identities = None
+
+    @classmethod
+    def from_request(cls, request: GrayDecisionRequest) -> "DecisionInput":
+        headers = {k.lower(): v for k, v in request.headers.items()} if request.headers else {}
+        return cls(request.user_id, normalize_ip(request.ip), headers, request.cookies)
+
+    def address(self):
+        """解析后的 IP 地址对象（惰性解析，同一请求只解析一次），无效时为 None"""
+        if self._address is _UNPARSED:
+            self._address = parse_ip(self.ip)
+        return self._address
+
+    def cookie_identities(self, name: str) -> Tuple[str, ...]:
+        """JWT cookie 解出的身份，同一请求内每个 cookie 只解析一次"""
+        memo = self._identities
+        if memo is None:
+            memo = self._identities = {}
+        identities = memo.get(name)
+        if identities is None:
+            cookie_value = self.cookies.get(name)
+            identities = memo[name] = decode_jwt_identities(cookie_value) if cookie_value else ()
+        return identities
+
+
+# ============== 匹配器 ==============
+
+class WhitelistMatcher:
+    """白名单匹配：用户ID 命中 user_id 类条目，或 IP 命中 ip 类条目/网段（规则内嵌值两者都算）"""
+    __slots__ = ("user_values", "ip_values", "ip_ranges", "_range_trie")
+
+    def __init__(self, user_values, ip_values, ip_ranges=()):
+        self.user_values = user_values
+        self.ip_values = ip_values
+        self.ip_ranges = tuple(ip_ranges)
+        self._range_trie = _build_trie(self.ip_ranges)
+
+    def match(self, inp: DecisionInput) -> bool:
+        if inp.user_id and inp.user_id in self.user_values:
+            return True
+        if inp.ip:
+            if inp.ip in self.ip_values:
+                return True
+            if self._range_trie is not None and inp.address() in self._range_trie:
+                return True
+        return False
+
+    def inputs(self):
+        return (("user_id", None), ("ip", None))
+
+    def index_entries(self):
+        if not (isinstance(self.user_values, frozenset) and isinstance(self.ip_values, frozenset)):
+            return None
+        return (
+            [("user", None, v) for v in self.user_values]
+            + [("ip", None, v) for v in self.ip_values]
+            + [("ip_range", None, n) for n in self.ip_ranges]
+        )
+
+
+class HeaderMatcher:
+    """Header 匹配"""
+    __slots__ = ("key", "values")
+
+    def __init__(self, key: str, values):
+        self.key = key.lower()
+        self.values = values
+
+    def match(self, inp: DecisionInput) -> bool:
+        header_value = inp.headers.get(self.key)
+        return bool(header_value) and header_value in self.values
+
+    def inputs(self):
+        return (("header", self.key),)
+
+    def index_entries(self):
+        if not isinstance(self.values, frozenset):
+            return None
+        return [("header", self.key, v) for v in self.values]
+
+
+class CookieMatcher:
+    """Cookie 匹配（JWT cookie 解码后比对 cname / name）"""
+    __slots__ = ("key", "values")
+
+    def __init__(self, key: str, values):
+        self.key = key
+        self.values = values
+
+    def match(self, inp: DecisionInput) -> bool:
+        values = self.values
+        for identity in inp.cookie_identities(self.key):
+            if identity in values:
+                return True
+        return False
+
+    def inputs(self):
+        return (("cookie", self.key),)
+
+    def index_entries(self):
+        if not isinstance(self.values, frozenset):
+            return None
+        return [("cookie", self.key, v) for v in self.values]
+
+
+class IpMatcher:
+    """IP 匹配：精确地址或 CIDR/区间网段"""
+    __slots__ = ("values", "ranges", "_range_trie")
+
+    def __init__(self, values, ranges=()):
+        self.values = values
+        self.ranges = tuple(ranges)
+        self._range_trie = _build_trie(self.ranges)
+
+    def match(self, inp: DecisionInput) -> bool:
+        if not inp.ip:
+            return False
+        if inp.ip in self.values:
+            return True
+        return self._range_trie is not None and inp.address() in self._range_trie
+
+    def inputs(self):
+        return (("ip", None),)
+
+    def index_entries(self):
+        if not isinstance(self.values, frozenset):
+            return None
+        return [("ip", None, v) for v in self.values] + [("ip_range", None, n) for n in self.ranges]
+
+
+PERCENTAGE_BUCKETS = 10000
+
+
+class PercentageMatcher:
+    """
+    百分比放量：对分桶键做 CRC32 哈希映射到 10000 个桶，桶号小于放量比例即命中
+
+    同一个键始终落在同一个桶，放量从 1% 调到 50% 时已命中的用户保持命中。
+    哈希加入规则 id 作为盐，不同规则的分桶互相独立。
+    分桶键（match_key）：user_id（默认）、ip、cookie:<名称>、header:<名称>；
+    JWT cookie 按解码出的 cname 分桶，避免重新登录换 token 后结果漂移。
+    """
+    __slots__ = ("source", "key", "threshold", "salt")
+
+    def __init__(self, rule_id: int, match_key: Optional[str], percentage: float):
+        source, _, key = (match_key or "user_id").partition(":")
+        self.source = source
+        self.key = key.lower() if source == "header" else key
+        self.threshold = round(percentage * PERCENTAGE_BUCKETS / 100)
+        self.salt = f"{rule_id}:".encode()
+
+    def bucket_key(self, inp: DecisionInput) -> Optional[str]:
+        source = self.source
+        if source == "user_id":
+            return inp.user_id
+        if source == "ip":
+            return inp.ip
+        if source == "header":
+            return inp.headers.get(self.key)
+        if source == "cookie":
+            cookie_value = inp.cookies.get(self.key)
+            if not cookie_value:
+                return None
+            identities = inp.cookie_identities(self.key)
+            return identities[0] if identities else cookie_value
+        return None
+
+    def match(self, inp: DecisionInput) -> bool:
+        if self.threshold <= 0:
+            return False
+        value = self.bucket_key(inp)
+        if not value:
+            return False
+        return zlib.crc32(self.salt + value.encode()) % PERCENTAGE_BUCKETS < self.threshold
+
+    def with_percentage(self, percentage: float) -> "PercentageMatcher":
+        """放量比例调整后的匹配器（分桶不变，已命中的用户在放大时保持命中）"""
+        matcher = copy.copy(self)
+        matcher.threshold = round(percentage * PERCENTAGE_BUCKETS / 100)
+        return matcher
+
+    def inputs(self):
+        if self.source in ("header", "cookie"):
+            return ((self.source, self.key),)
+        return ((self.source, None),)
+
+    def index_entries(self):
+        return None
+
+
+def _build_trie(networks) -> Optional[IpPrefixTrie]:
+    if not networks:
+        return None
+    trie = IpPrefixTrie()
+    for network in networks:
+        trie.insert(network)
+    return trie
+
+
+# ============== 编译结果 ==============
+
+class CompiledRule:
+    """编译后的单条规则"""
+    __slots__ = (
+        "id", "name", "priority", "match_type", "is_shadow",
+        "target_version", "target_upstream", "reason", "matcher",
+        "active_from", "active_until", "ramp",
+    )
+
+    def __init__(self, rule, matcher):
+        self.id = rule.id
+        self.name = rule.name
+        self.priority = rule.priority or 0
+        self.match_type = rule.match_type
+        self.is_shadow = bool(getattr(rule, "is_shadow", False))
+        self.target_version = rule.target_version
+        self.target_upstream = rule.target_upstream
+        self.reason = f"Matched rule: {rule.name} ({rule.match_type})"
+        self.matcher = matcher
+        # 生效窗口 [active_from, active_until)，以及定时放量步骤 ((时间戳, 放量比例), ...)
+        active_from = getattr(rule, "active_from", None)
+        active_until = getattr(rule, "active_until", None)
+        self.active_from = _timestamp(active_from) if active_from else -_FOREVER
+        self.active_until = _timestamp(active_until) if active_until else _FOREVER
+        self.ramp: Tuple[Tuple[float, float], ...] = ()
+
+    def boundaries(self) -> List[float]:
+        """规则状态发生变化的时间点"""
+        points = [self.active_from, self.active_until]
+        points.extend(at for at, _ in self.ramp)
+        return [point for point in points if math.isfinite(point)]
+
+    def at(self, now: float) -> Optional["CompiledRule"]:
+        """now 时刻生效的规则：不在生效窗口内返回 None，已进入放量步骤时返回调整了放量比例的副本"""
+        if not self.active_from <= now < self.active_until:
+            return None
+        percentage = None
+        for at, step in self.ramp:
+            if at > now:
+                break
+            percentage = step
+        if percentage is None:
+            return self
+        rule = copy.copy(self)
+        rule.matcher = self.matcher.with_percentage(percentage)
+        return rule
+
+
+class DecisionPlan:
+    """
+    不可变的决策计划：按优先级排好序的编译规则 + 倒排索引
+
+    存在影子规则时，shadow 为包含线上规则和影子规则的影子计划（只用于统计，不参与路由）。
+    计划只在 valid_until（时间戳）之前有效，之后由 next_plan 接替（见 current）。
+    """
+    __slots__ = (
+        "version", "rules", "shadow", "valid_until", "next_plan", "cacheable", "header_keys", "cookie_names",
+        "_reads_user_id", "_reads_ip", "_header_list", "_cookie_list",
+        "_by_user", "_by_ip", "_ip_trie", "_by_header", "_by_cookie", "_residual",
+    )
+
+    def __init__(
+        self,
+        rules: Tuple[CompiledRule, ...],
+        version: int = 0,
+        shadow: Optional["DecisionPlan"] = None,
+        valid_until: float = _FOREVER,
+        next_plan: Optional["DecisionPlan"] = None,
+    ):
+        self.version = version
+        self.rules = rules
+        self.shadow = shadow
+        self.valid_until = valid_until
+        self.next_plan = next_plan
+
+        # 规则实际读取的请求属性：快速通道只提取这些 header / cookie
+        inputs = {item for rule in rules for item in rule.matcher.inputs()}
+        self.header_keys = frozenset(key for kind, key in inputs if kind == "header")
+        self.cookie_names = frozenset(key for kind, key in inputs if kind == "cookie")
+        self._reads_user_id = ("user_id", None) in inputs
+        self._reads_ip = ("ip", None) in inputs
+        self._header_list = tuple(sorted(self.header_keys))
+        self._cookie_list = tuple(sorted(self.cookie_names))
+
+        # 倒排索引：值 -> 命中规则位置的升序元组（位置越小优先级越高）
+        by_user: Dict[str, List[int]] = {}
+        by_ip: Dict[str, List[int]] = {}
+        by_header: Dict[str, Dict[str, List[int]]] = {}
+        by_cookie: Dict[str, Dict[str, List[int]]] = {}
+        ip_trie = IpPrefixTrie()
+        residual = []
+        for pos, rule in enumerate(rules):
+            entries = rule.matcher.index_entries()
+            if entries is None:
+                residual.append((pos, rule.matcher.match))
+                continue
+            for dimension, key, value in entries:
+                if dimension == "ip_range":
+                    ip_trie.insert(value, pos)
+                    continue
+                if dimension == "user":
+                    target = by_user
+                elif dimension == "ip":
+                    target = by_ip
+                elif dimension == "header":
+                    target = by_header.setdefault(key, {})
+                else:
+                    target = by_cookie.setdefault(key, {})
+                target.setdefault(value, []).append(pos)
+
+        def freeze(index):
+            return {value: tuple(positions) for value, positions in index.items()}
+
+        self._by_user = freeze(by_user)
+        self._by_ip = freeze(by_ip)
+        self._ip_trie = ip_trie if len(ip_trie) else None
+        self._by_header = tuple((key, freeze(index)) for key, index in by_header.items())
+        self._by_cookie = tuple((key, freeze(index)) for key, index in by_cookie.items())
+        self._residual = tuple(residual)
+        # 只有倒排索引（dict / 前缀树查找）时直接匹配比查决策缓存更快；
+        # 需要逐条执行的剩余规则（百分比、快照承载）或需要解码 JWT 的 cookie 规则才值得缓存
+        self.cacheable = bool(self._residual or self._by_cookie)
+
+    def current(self, now: float) -> "DecisionPlan":
+        """now 时刻有效的计划（沿时间线向后查找）"""
+        plan = self
+        while plan.valid_until <= now:
+            plan = plan.next_plan
+        return plan
+
+    def fingerprint(self, inp: DecisionInput) -> tuple:
+        """只由本计划实际读取的请求属性构成的键：键相同的请求决策结果必然相同"""
+        return (
+            inp.user_id if self._reads_user_id else None,
+            inp.ip if self._reads_ip else None,
+            tuple(map(inp.headers.get, self._header_list)),
+            tuple(map(inp.cookies.get, self._cookie_list)),
+        )
+
+    def evaluate(self, inp: DecisionInput) -> Optional[CompiledRule]:
+        """返回优先级最高的命中规则，无命中返回 None"""
+        best = len(self.rules)
+
+        if inp.user_id:
+            hit = self._by_user.get(inp.user_id)
+            if hit and hit[0] < best:
+                best = hit[0]
+        if inp.ip:
+            hit = self._by_ip.get(inp.ip)
+            if hit and hit[0] < best:
+                best = hit[0]
+            if self._ip_trie is not None:
+                pos = self._ip_trie.lookup(inp.address())
+                if pos is not None and pos < best:
+                    best = pos
+        if self._by_header:
+            headers = inp.headers
+            for key, index in self._by_header:
+                header_value = headers.get(key)
+                if header_value:
+                    hit = index.get(header_value)
+                    if hit and hit[0] < best:
+                        best = hit[0]
+        if self._by_cookie:
+            for key, index in self._by_cookie:
+                for identity in inp.cookie_identities(key):
+                    hit = index.get(identity)
+                    if hit and hit[0] < best:
+                        best = hit[0]
+
+        # 剩余规则只需检查排在当前最优命中之前的
+        for pos, match in self._residual:
+            if pos >= best:
+                break
+            if match(inp):
+                best = pos
+                break
+
+        return self.rules[best] if best < len(self.rules) else None
+
+
+def split_whitelist_values(match_values: Iterable[str], entries: Iterable[Tuple[str, str]]):
+    """
+    按维度拆分白名单值：ip 类条目只比对 IP，其余条目只比对用户ID；
+    规则内嵌的 match_values 没有类型，两个维度都参与。
+    CIDR/区间形式的 IP 值单独拆出为网段。返回 (user_values, ip_values, ip_ranges)
+    """
+    user_values = set()
+    ip_values = set()
+    ip_ranges = []
+    for value in match_values:
+        networks = parse_ip_range(value)
+        if networks:
+            ip_ranges.extend(networks)
+        else:
+            user_values.add(value)
+            ip_values.add(normalize_ip(value))
+    for value, value_type in entries:
+        if value_type == "ip":
+            networks = parse_ip_range(value)
+            if networks:
+                ip_ranges.extend(networks)
+            else:
+                ip_values.add(normalize_ip(value))
+        else:
+            user_values.add(value)
+    return user_values, ip_values, ip_ranges
+
+
+def split_ip_values(match_values: Iterable[str]):
+    """把 IP 规则的 match_values 拆成 (精确地址, 网段列表)"""
+    values = set()
+    ranges = []
+    for value in match_values:
+        networks = parse_ip_range(value)
+        if networks:
+            ranges.extend(networks)
+        else:
+            values.add(normalize_ip(value))
+    return values, ranges
+
+
+def compile_rule(rule, whitelist_entries: Iterable[Tuple[str, str]] = (), snapshot=None) -> Optional[CompiledRule]:
+    """
+    编译单条规则
+
+    rule 只需提供 GrayRuleDB 的字段属性；未知的 match_type 不参与匹配，返回 None。
+    whitelist_entries 为白名单条目的 (value, value_type)；
+    snapshot 为共享的值快照（已包含 match_values 及白名单的精确值），提供时替代进程内的 frozenset，
+    此时 whitelist_entries 只需包含快照之外的网段条目。
+    """
+    match_type = rule.match_type
+    match_values = rule.match_values or ()
+
+    if match_type == "whitelist":
+        user_values, ip_values, ip_ranges = split_whitelist_values(match_values, whitelist_entries)
+        if snapshot is not None:
+            user_values = snapshot.segment("user_id") or frozenset()
+            ip_values = snapshot.segment("ip") or frozenset()
+        else:
+            user_values, ip_values = frozenset(user_values), frozenset(ip_values)
+        return CompiledRule(rule, WhitelistMatcher(user_values, ip_values, ip_ranges))
+
+    if match_type == "ip":
+        ip_values, ip_ranges = split_ip_values(match_values)
+        if snapshot is not None:
+            ip_values = snapshot.segment("values") or frozenset()
+        else:
+            ip_values = frozenset(ip_values)
+        return CompiledRule(rule, IpMatcher(ip_values, ip_ranges))
+
+    if match_type == "percentage":
+        compiled = CompiledRule(rule, PercentageMatcher(rule.id, rule.match_key, rule.rollout_percentage or 0))
+        steps = getattr(rule, "rollout_steps", None) or ()
+        compiled.ramp = tuple(sorted((_timestamp(step["at"]), float(step["percentage"])) for step in steps))
+        return compiled
+
+    values = (snapshot.segment("values") if snapshot is not None else None) or frozenset(match_values)
+    if match_type == "header":
+        if not rule.match_key:
+            return None
+        matcher = HeaderMatcher(rule.match_key, values)
+    elif match_type == "cookie":
+        if not rule.match_key:
+            return None
+        matcher = CookieMatcher(rule.match_key, values)
+    else:
+        return None
+
+    return CompiledRule(rule, matcher)
+
+
+def compile_plan(
+    rules: Iterable,
+    whitelists: Dict[int, Iterable[Tuple[str, str]]],
+    version: int = 0,
+    now: Optional[float] = None,
+) -> DecisionPlan:
+    """把规则列表（及其白名单条目）编译成 now 时刻（默认当前时间）的决策计划"""
+    compiled = []
+    for rule in rules:
+        item = compile_rule(rule, whitelists.get(rule.id, ()))
+        if item is not None:
+            compiled.append(item)
+    return build_plan(compiled, version, now)
+
+
+def _build_segment(
+    compiled: Tuple[CompiledRule, ...],
+    version: int,
+    now: float,
+    valid_until: float = _FOREVER,
+    next_plan: Optional[DecisionPlan] = None,
+) -> DecisionPlan:
+    rules = (rule.at(now) for rule in compiled)
+    ordered = tuple(sorted((rule for rule in rules if rule is not None), key=lambda r: (-r.priority, r.id)))
+    live = tuple(rule for rule in ordered if not rule.is_shadow)
+    shadow = DecisionPlan(ordered, version) if len(live) < len(ordered) else None
+    return DecisionPlan(live, version, shadow, valid_until, next_plan)
+
+
+def build_plan(compiled: Iterable[CompiledRule], version: int = 0, now: Optional[float] = None) -> DecisionPlan:
+    """
+    用已编译的规则组装决策计划（优先级降序，同优先级按 id 升序）
+
+    影子规则不进入线上计划，而是与线上规则一起组成附带的影子计划。
+    规则存在晚于 now 的生效边界时，按边界切分时间线，返回当前区间的计划（后续区间经 next_plan 串联）。
+    """
+    compiled = tuple(compiled)
+    now = time.time() if now is None else now
+    points = sorted({point for rule in compiled for point in rule.boundaries() if point > now})
+    plan = None
+    for start, end in reversed(list(zip([now] + points, points + [_FOREVER]))):
+        plan = _build_segment(compiled, version, start, end, plan)
+    return plan
@@ -1,60 +1,336 @@
 """灰度决策服务"""
-from typing import Optional, List
-from sqlalchemy import select
+from typing import Any, AsyncIterator, Optional, List, Dict, Iterable, Tuple
+from pydantic import ValidationError
+from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
-from urllib.parse import unquote
-import jwt
+import asyncio
 import time
 
-from ..models import GrayRuleDB, WhitelistDB, GrayDecisionRequest, GrayDecisionResponse
+from ..models import (
+    async_session,
+    GrayRuleDB, WhitelistDB, RuleChangeDB,
+    GrayDecisionRequest, GrayDecisionResponse,
+)
+from .decision_plan import (
+    DecisionPlan, DecisionInput, CompiledRule,
+    compile_rule, build_plan, split_whitelist_values, split_ip_values,
+)
+from .ip_index import normalize_ip, parse_ip_range
+from .decision_cache import decision_cache
+from .decision_log import decision_log
+from .shadow import shadow_evaluator
+from .metrics import registry, rules_cache_reload_duration
+from .snapshot import ValueSnapshot, open_snapshot, publish_snapshot, remove_snapshot
+from .rule_set_snapshot import load_rule_set, save_rule_set
+from config import CACHE_SYNC_MAX_BACKOFF, RULE_SET_SNAPSHOT_PATH, SNAPSHOT_MIN_VALUES
 
 
 # ===== 全局缓存（进程级别）=====
 class RulesCache:
-    """规则缓存管理器"""
+    """
+    规则缓存管理器
+
+    缓存与数据库中的规则集版本（rule_changes 最大 id）对齐：
+    版本不变时决策路径不访问数据库；版本前进时只重新加载变更涉及的规则或白名单条目，
+    并只重新编译受影响的规则。
+    值数量达到 SNAPSHOT_MIN_VALUES 的规则不在进程内保存值，而是映射共享的快照文件。
+    整体加载由 ensure_plan 单飞执行：并发的未命中请求共享同一次加载。
+    每次发布新版本后写入规则集快照，worker 启动时优先从快照加载（source 为 snapshot）。
+    """
     _instance = None
     
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
-            cls._instance._rules = None
-            cls._instance._rules_time = 0
-            cls._instance._whitelists: Dict[int, List] = {}
-            cls._instance._whitelists_time: Dict[int, float] = {}
-            cls._instance._ttl = 60  # 缓存 60 秒
+            cls._instance.version = 0  # 已应用的规则集版本
+            cls._instance.loaded = False
+            cls._instance.source = None  # 最近一次整体加载的来源：database / snapshot
+            cls._instance._rules: Dict[int, GrayRuleDB] = {}  # 启用的规则
+            cls._instance._whitelists: Dict[int, Dict[int, Tuple[str, str]]] = {}  # rule_id -> {白名单ID: (值, 值类型)}
+            cls._instance._snapshots: Dict[int, ValueSnapshot] = {}  # 快照承载的大规则
+            cls._instance._compiled: Dict[int, CompiledRule] = {}
+            cls._instance._plan: Optional[DecisionPlan] = None
+            cls._instance.lock = asyncio.Lock()  # 串行化加载与增量同步
+            cls._instance.loading: Optional[asyncio.Task] = None  # 进行中的整体加载
         return cls._instance
     
-    def get_rules(self):
-        if self._rules and (time.time() - self._rules_time) < self._ttl:
-            print(f"命中规则缓存: {self._rules}")
-            return self._rules
-        return None
+    def get_plan(self) -> Optional[DecisionPlan]:
+        plan = self._plan
+        if plan is not None and plan.valid_until <= time.time():
+            # 到达定时规则的生效边界：切换到预先编译好的下一段计划
+            plan = self._plan = plan.current(time.time())
+        return plan
+    
+    def has_rule(self, rule_id: int) -> bool:
+        return rule_id in self._rules
     
-    def set_rules(self, rules):
-        self._rules = rules
-        self._rules_time = time.time()
+    def has_whitelist(self, rule_id: int) -> bool:
+        """规则已缓存且是白名单类型（白名单值已加载到进程内）"""
+        rule = self._rules.get(rule_id)
+        return rule is not None and rule.match_type == "whitelist" and rule_id not in self._snapshots
     
-    def get_whitelist(self, rule_id: int):
-        if rule_id in self._whitelists:
-            if (time.time() - self._whitelists_time.get(rule_id, 0)) < self._ttl:
-                return self._whitelists[rule_id]
-        return None
+    def is_snapshot_backed(self, rule_id: int) -> bool:
+        return rule_id in self._snapshots
     
-    def set_whitelist(self, rule_id: int, whitelist):
-        self._whitelists[rule_id] = whitelist
-        self._whitelists_time[rule_id] = time.time()
+    def load(
+        self,
+        version: int,
+        rules: Iterable[GrayRuleDB],
+        whitelists: Dict[int, Dict[int, Tuple[str, str]]],
+        snapshots: Dict[int, ValueSnapshot],
+        source: str = "database",
+    ):
+        """整体加载规则集"""
+        self._rules = {rule.id: rule for rule in rules}
+        self._whitelists = {rule_id: whitelists.get(rule_id, {}) for rule_id in self._rules}
+        self._snapshots = dict(snapshots)
+        self._compiled = {}
+        for rule_id in self._rules:
+            self._compile(rule_id)
+        self.version = version
+        self.loaded = True
+        self.source = source
+        self._plan = build_plan(self._compiled.values(), version)
+
+    def snapshot_state(self) -> tuple:
+        """当前缓存内容，供写入规则集快照：(版本, 规则, 白名单, {规则ID: 值快照版本})"""
+        return (
+            self.version,
+            list(self._rules.values()),
+            {rule_id: dict(entries) for rule_id, entries in self._whitelists.items()},
+            {rule_id: snapshot.version for rule_id, snapshot in self._snapshots.items()},
+        )
+    
+    def put_rule(
+        self,
+        rule: GrayRuleDB,
+        whitelist: Optional[Dict[int, Tuple[str, str]]] = None,
+        snapshot: Optional[ValueSnapshot] = None,
+    ):
+        """
+        新增/更新启用的规则；whitelist 为 None 时保留已缓存的白名单。
+        snapshot 表示改由快照承载，此时 whitelist 只包含快照之外的网段条目
+        """
+        self._rules[rule.id] = rule
+        if snapshot is not None:
+            self._snapshots[rule.id] = snapshot
+            self._whitelists[rule.id] = whitelist or {}
+            return
+        self._snapshots.pop(rule.id, None)
+        if rule.match_type != "whitelist":
+            self._whitelists[rule.id] = {}
+        elif whitelist is not None:
+            self._whitelists[rule.id] = whitelist
+        else:
+            self._whitelists.setdefault(rule.id, {})
+    
+    def remove_rule(self, rule_id: int):
+        self._rules.pop(rule_id, None)
+        self._whitelists.pop(rule_id, None)
+        self._snapshots.pop(rule_id, None)
+        self._compiled.pop(rule_id, None)
+    
+    def put_whitelist_entry(self, rule_id: int, whitelist_id: int, value: str, value_type: str):
+        if rule_id in self._rules:
+            self._whitelists[rule_id][whitelist_id] = (value, value_type)
+    
+    def remove_whitelist_entry(self, rule_id: int, whitelist_id: int):
+        if rule_id in self._rules:
+            self._whitelists[rule_id].pop(whitelist_id, None)
+    
+    def commit(self, version: int, dirty_rule_ids: Iterable[int]):
+        """重新编译受影响的规则并发布新版本的决策计划"""
+        for rule_id in dirty_rule_ids:
+            if rule_id in self._rules:
+                self._compile(rule_id)
+        self.version = max(self.version, version)
+        self._plan = build_plan(self._compiled.values(), self.version)
+    
+    def _compile(self, rule_id: int):
+        compiled = compile_rule(
+            self._rules[rule_id],
+            self._whitelists[rule_id].values(),
+            self._snapshots.get(rule_id),
+        )
+        if compiled is None:
+            self._compiled.pop(rule_id, None)
+        else:
+            self._compiled[rule_id] = compiled
     
     def clear(self):
-        """清除所有缓存（规则更新时调用）"""
-        self._rules = None
-        self._rules_time = 0
-        self._whitelists.clear()
-        self._whitelists_time.clear()
+        """清除所有缓存，下次决策时整体重新加载"""
+        self.version = 0
+        self.loaded = False
+        self.source = None
+        self._rules = {}
+        self._whitelists = {}
+        self._snapshots = {}
+        self._compiled = {}
+        self._plan = None
 
 
 # 全局缓存实例
 rules_cache = RulesCache()
 
+registry.callback("gray_rule_cache_ready", "规则缓存是否已加载（1 为就绪）", lambda: int(rules_cache.loaded))
+registry.callback("gray_rule_set_version", "已加载的规则集版本", lambda: rules_cache.version)
+registry.callback("gray_rule_cache_rules", "缓存中启用的规则数", lambda: len(rules_cache._rules))
+registry.callback(
+    "gray_rule_cache_snapshot_rules", "由共享快照承载的规则数", lambda: len(rules_cache._snapshots)
+)
+registry.callback(
+    "gray_rule_cache_whitelist_entries",
+    "进程内保存的白名单条目数",
+    lambda: sum(len(entries) for entries in rules_cache._whitelists.values()),
+)
+_full_reload_duration = rules_cache_reload_duration.labels("full")
+_snapshot_reload_duration = rules_cache_reload_duration.labels("snapshot")
+_incremental_reload_duration = rules_cache_reload_duration.labels("incremental")
+
+
+async def record_rule_change(
+    session: AsyncSession,
+    rule_id: int,
+    entity: str = "rule",
+    entity_id: Optional[int] = None,
+    action: str = "update",
+) -> int:
+    """在当前事务中写入一条变更日志，返回新的规则集版本号"""
+    change = RuleChangeDB(rule_id=rule_id, entity=entity, entity_id=entity_id, action=action)
+    session.add(change)
+    await session.flush()
+    return change.id
+
+
+async def _save_rule_set(force: bool = False):
+    """把当前缓存写入规则集快照（在 rules_cache.lock 内调用）"""
+    if not RULE_SET_SNAPSHOT_PATH:
+        return
+    try:
+        await asyncio.to_thread(save_rule_set, *rules_cache.snapshot_state(), force=force)
+    except OSError as exc:
+        print(f"⚠️ Rule set snapshot write failed: {exc}")
+
+
+_background_tasks = set()
+
+
+async def _catch_up(snapshot_version: int):
+    """
+    从快照加载后通过变更日志增量追平数据库
+
+    数据库不可用时继续使用快照（之后由 watch_rule_changes 继续重试）；
+    数据库版本比快照还旧（快照来自其他数据库或数据库被重置）时丢弃快照，改为从数据库整体加载。
+    """
+    try:
+        async with async_session() as session:
+            service = GrayService(session)
+            if await service.get_rule_set_version() < snapshot_version:
+                print(f"⚠️ Rule set snapshot (version {snapshot_version}) is ahead of the database, reloading")
+                await service.load_rules_cache(force=True)
+                return
+            await service.sync_rules_cache()
+    except Exception as exc:
+        print(f"⚠️ Database unavailable, serving rule set snapshot (version {snapshot_version}): {exc}")
+
+
+async def _load_from_snapshot() -> bool:
+    """
+    从规则集快照加载，返回是否已加载
+
+    不等待数据库：锁库或慢盘时也能立即开始决策，追平数据库在后台进行。
+    """
+    async with rules_cache.lock:
+        if rules_cache.loaded:
+            return True
+        started = time.perf_counter()
+        snapshot = await asyncio.to_thread(load_rule_set)
+        if snapshot is None:
+            return False
+        rules_cache.load(snapshot.version, snapshot.rules, snapshot.whitelists, snapshot.snapshots, source="snapshot")
+        _snapshot_reload_duration.observe(time.perf_counter() - started)
+
+    task = asyncio.create_task(_catch_up(snapshot.version))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return True
+
+
+async def _load_plan() -> DecisionPlan:
+    if not (RULE_SET_SNAPSHOT_PATH and await _load_from_snapshot()):
+        async with async_session() as session:
+            await GrayService(session).load_rules_cache()
+    return rules_cache.get_plan()
+
+
+def _loading_done(task: asyncio.Task):
+    rules_cache.loading = None
+    if not task.cancelled():
+        task.exception()  # 失败时由等待方处理，这里只标记为已读取
+
+
+async def ensure_plan() -> DecisionPlan:
+    """
+    获取决策计划，缓存未加载时整体加载
+
+    加载是单飞的：并发的未命中请求等待同一个加载任务，不会各自占用连接重复读库；
+    加载任务独立于调用方，某个请求被取消不会中断其他请求等待的加载。
+    """
+    plan = rules_cache.get_plan()
+    if plan is not None:
+        return plan
+    task = rules_cache.loading
+    if task is None:
+        task = rules_cache.loading = asyncio.ensure_future(_load_plan())
+        task.add_done_callback(_loading_done)
+    return await asyncio.shield(task)
+
+
+async def warm_up() -> bool:
+    """启动预热：加载并编译完整规则集，失败时返回 False（由后台同步任务重试）"""
+    try:
+        await ensure_plan()
+    except Exception as exc:
+        print(f"⚠️ Rule cache warm-up failed: {exc}")
+        return False
+    return True
+
+
+async def watch_rule_changes(interval: float, max_backoff: float = CACHE_SYNC_MAX_BACKOFF):
+    """
+    跨 worker 缓存同步
+
+    多 worker 部署时，管理接口的写操作只会同步处理该请求的 worker。
+    每个 worker 在后台按 interval 轮询变更日志的最大版本号，发现前进时应用增量，
+    无需外部服务即可在毫秒级收敛。
+    启动预热失败（如数据库暂不可用）时，在这里重试整体加载。
+    数据库故障期间轮询间隔按指数退避（上限 max_backoff 秒），只在开始失败和恢复时各输出一次日志。
+    """
+    delay = interval
+    failing = not rules_cache.loaded  # 启动预热失败已输出过日志
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            if not rules_cache.loaded:
+                await ensure_plan()
+            else:
+                async with async_session() as session:
+                    service = GrayService(session)
+                    if await service.get_rule_set_version() > rules_cache.version:
+                        await service.sync_rules_cache()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            if not failing:
+                failing = True
+                print(f"⚠️ Rule cache sync failed, retrying with backoff: {exc}")
+            delay = min(max(delay, interval) * 2, max_backoff)
+            continue
+        if failing:
+            failing = False
+            print(f"✅ Rule cache sync recovered (version {rules_cache.version})")
+        delay = interval
+
 
 class GrayService:
     """灰度决策核心服务"""
@@ -62,139 +338,258 @@ class GrayService:
     def __init__(self, session: AsyncSession):
         self.session = session
     
+    async def get_rule_set_version(self) -> int:
+        """数据库中的当前规则集版本"""
+        result = await self.session.execute(select(func.max(RuleChangeDB.id)))
+        return result.scalar() or 0
+    
     async def get_all_enabled_rules(self) -> List[GrayRuleDB]:
         """获取所有启用的规则，按优先级排序"""
-         # 先检查缓存
-        cached = rules_cache.get_rules()
-        if cached is not None:
-            return cached
-
         result = await self.session.execute(
             select(GrayRuleDB)
             .where(GrayRuleDB.is_enabled == True)
             .order_by(GrayRuleDB.priority.desc())
         )
-        rules = result.scalars().all()
-        
-        # 存入缓存
-        rules_cache.set_rules(rules)
-        return rules
+        return result.scalars().all()
     
     async def get_whitelist_by_rule(self, rule_id: int) -> List[WhitelistDB]:
         """获取规则关联的白名单"""
-        # 先检查缓存
-        cached = rules_cache.get_whitelist(rule_id)
-        if cached is not None:
-            return cached
-
         result = await self.session.execute(
             select(WhitelistDB)
             .where(WhitelistDB.rule_id == rule_id)
             .where(WhitelistDB.is_enabled == True)
         )
-        whitelist = result.scalars().all()
-        
-        # 存入缓存
-        rules_cache.set_whitelist(rule_id, whitelist)
-        return whitelist
-    
-    async def check_whitelist_match(self, rule: GrayRuleDB, request: GrayDecisionRequest) -> bool:
-        """检查白名单匹配"""
-        # 获取规则对应的白名单
-        whitelists = await self.get_whitelist_by_rule(rule.id)
-        whitelist_values = set(w.value for w in whitelists)
-        
-        # 同时检查规则内嵌的 match_values
-        if rule.match_values:
-            whitelist_values.update(rule.match_values)
-        
-        if not whitelist_values:
-            return False
-        
-        # 根据不同的值类型进行匹配
-        for wl in whitelists:
-            if wl.value_type == "user_id" and request.user_id:
-                if request.user_id in whitelist_values:
-                    return True
-            elif wl.value_type == "ip" and request.ip:
-                if request.ip in whitelist_values:
-                    return True
+        return result.scalars().all()
+    
+    async def _count_whitelist_values(self, rule_ids: List[int]) -> Dict[int, int]:
+        """一次查询统计多条规则的启用白名单条目数"""
+        if not rule_ids:
+            return {}
+        result = await self.session.execute(
+            select(WhitelistDB.rule_id, func.count())
+            .where(WhitelistDB.rule_id.in_(rule_ids))
+            .where(WhitelistDB.is_enabled == True)
+            .group_by(WhitelistDB.rule_id)
+        )
+        return dict(result.all())
+    
+    async def _ensure_snapshot(self, rule: GrayRuleDB) -> ValueSnapshot:
+        """
+        映射规则的值快照
+
+        快照缺失或早于该规则的最新变更时，从数据库流式读取值并重新发布。
+        通常由处理管理写操作的 worker 发布，其余 worker 只做映射。
+        """
+        result = await self.session.execute(
+            select(func.max(RuleChangeDB.id)).where(RuleChangeDB.rule_id == rule.id)
+        )
+        required = result.scalar() or 0
+        snapshot = open_snapshot(rule.id)
+        if snapshot is not None and snapshot.version >= required:
+            return snapshot
         
-        # 检查规则自带的 match_values
-        if request.user_id and request.user_id in whitelist_values:
-            return True
-        if request.ip and request.ip in whitelist_values:
-            return True
+        if rule.match_type == "whitelist":
+            stream = await self.session.stream(
+                select(WhitelistDB.value, WhitelistDB.value_type)
+                .where(WhitelistDB.rule_id == rule.id)
+                .where(WhitelistDB.is_enabled == True)
+            )
+            # 网段条目不进快照，由 _load_whitelist_values(ranges_only=True) 加载到进程内
+            user_values, ip_values, _ = split_whitelist_values(rule.match_values or (), ())
+            async for value, value_type in stream:
+                if value_type != "ip":
+                    user_values.add(value)
+                elif parse_ip_range(value) is None:
+                    ip_values.add(normalize_ip(value))
+            segments = {"user_id": user_values, "ip": ip_values}
+        elif rule.match_type == "ip":
+            segments = {"values": split_ip_values(rule.match_values or ())[0]}
+        else:
+            segments = {"values": rule.match_values or ()}
+        await asyncio.to_thread(publish_snapshot, rule.id, required, segments)
+        return open_snapshot(rule.id)
+    
+    async def _load_whitelist_values(
+        self, rule_ids: List[int], ranges_only: bool = False
+    ) -> Dict[int, Dict[int, Tuple[str, str]]]:
+        """
+        一次查询加载多条规则的启用白名单条目
+
+        ranges_only 时只加载 CIDR/区间形式的 IP 条目（快照承载的规则只有这部分留在进程内）。
+        """
+        whitelists: Dict[int, Dict[int, Tuple[str, str]]] = {rule_id: {} for rule_id in rule_ids}
+        if not rule_ids:
+            return whitelists
+        query = (
+            select(WhitelistDB.id, WhitelistDB.rule_id, WhitelistDB.value, WhitelistDB.value_type)
+            .where(WhitelistDB.rule_id.in_(rule_ids))
+            .where(WhitelistDB.is_enabled == True)
+        )
+        if ranges_only:
+            query = query.where(WhitelistDB.value_type == "ip").where(
+                WhitelistDB.value.contains("/") | WhitelistDB.value.contains("-")
+            )
+        result = await self.session.execute(query)
+        for whitelist_id, rule_id, value, value_type in result:
+            whitelists[rule_id][whitelist_id] = (value, value_type)
+        return whitelists
+    
+    async def load_rules_cache(self, force: bool = False):
+        """从数据库整体加载规则集到缓存（force 时替换已加载的规则集）"""
+        async with rules_cache.lock:
+            if rules_cache.loaded and not force:
+                return
+            started = time.perf_counter()
+            # 先读版本再读数据：期间若有新变更，数据只会比版本新，之后重复应用增量是幂等的
+            version = await self.get_rule_set_version()
+            rules = await self.get_all_enabled_rules()
+            counts = await self._count_whitelist_values(
+                [rule.id for rule in rules if rule.match_type == "whitelist"]
+            )
             
-        return False
+            snapshots = {}
+            small_whitelist_ids = []
+            for rule in rules:
+                if len(rule.match_values or ()) + counts.get(rule.id, 0) >= SNAPSHOT_MIN_VALUES:
+                    snapshots[rule.id] = await self._ensure_snapshot(rule)
+                elif rule.match_type == "whitelist":
+                    small_whitelist_ids.append(rule.id)
+            whitelists = await self._load_whitelist_values(small_whitelist_ids)
+            whitelists.update(await self._load_whitelist_values(
+                [rule.id for rule in rules if rule.id in snapshots and rule.match_type == "whitelist"],
+                ranges_only=True,
+            ))
+            rules_cache.load(version, rules, whitelists, snapshots)
+            _full_reload_duration.observe(time.perf_counter() - started)
+            await _save_rule_set(force=True)
     
-    async def check_header_match(self, rule: GrayRuleDB, request: GrayDecisionRequest) -> bool:
-        """检查 Header 匹配"""
-        if not request.headers or not rule.match_key:
-            return False
-        
-        header_value = request.headers.get(rule.match_key)
-        if header_value and rule.match_values:
-            return header_value in rule.match_values
-        return False
+    async def sync_rules_cache(self) -> int:
+        """
+        把缓存同步到数据库的最新版本
+
+        读取 rule_changes 中晚于缓存版本的变更，只重新加载涉及的规则或白名单条目。
+        缓存尚未加载时不做任何事（下次决策时整体加载）。返回同步后的版本。
+        """
+        async with rules_cache.lock:
+            if not rules_cache.loaded:
+                return 0
+            started = time.perf_counter()
+            result = await self.session.execute(
+                select(RuleChangeDB)
+                .where(RuleChangeDB.id > rules_cache.version)
+                .order_by(RuleChangeDB.id)
+            )
+            changes = result.scalars().all()
+            if not changes:
+                return rules_cache.version
+            
+            # 规则变更重载规则行；批量白名单变更重载该规则的整份白名单；其余只重载单个白名单条目
+            rule_ids = {c.rule_id for c in changes if c.entity == "rule"}
+            # 快照承载的规则无法逐条修改，任何白名单变更都重新发布整份快照
+            full_whitelist_ids = {
+                c.rule_id for c in changes
+                if c.entity == "whitelist" and (c.entity_id is None or rules_cache.is_snapshot_backed(c.rule_id))
+            }
+            whitelist_changes = {
+                c.entity_id: c.rule_id for c in changes
+                if c.entity == "whitelist" and c.entity_id is not None and c.rule_id not in full_whitelist_ids
+            }
+            
+            for rule_id in rule_ids | full_whitelist_ids:
+                await self._reload_rule(rule_id, reload_whitelist=rule_id in full_whitelist_ids)
+            await self._reload_whitelist_entries(whitelist_changes)
+            
+            dirty = rule_ids | full_whitelist_ids | set(whitelist_changes.values())
+            rules_cache.commit(changes[-1].id, dirty)
+            _incremental_reload_duration.observe(time.perf_counter() - started)
+            await _save_rule_set()
+            return rules_cache.version
     
-    async def check_cookie_match(self, rule: GrayRuleDB, request: GrayDecisionRequest) -> bool:
-        """检查 Cookie 匹配"""
-        if not request.cookies or not rule.match_key:
-            return False
+    async def _reload_rule(self, rule_id: int, reload_whitelist: bool = False):
+        result = await self.session.execute(
+            select(GrayRuleDB).where(GrayRuleDB.id == rule_id)
+        )
+        rule = result.scalar_one_or_none()
+        if rule is None or not rule.is_enabled:
+            rules_cache.remove_rule(rule_id)
+            if rule is None:
+                remove_snapshot(rule_id)
+            return
         
-        cookie_value = request.cookies.get(rule.match_key)
-        # print(f"cookie_value: {cookie_value}")
-        # jwt token 需要解码
-        if cookie_value:
-            cookie_value = unquote(cookie_value)
-            if  cookie_value.startswith("JWT"):
-                cookie_value = cookie_value.split(" ")[1]
-                token_payload = jwt.decode(cookie_value, options={"verify_signature": False})
-                # print(token_payload['data'])
-                if token_payload['data']['cname'] in rule.match_values or token_payload['data']['name'] in rule.match_values:
-                    return True
-                return False
-        return False
+        count = len(rule.match_values or ())
+        if rule.match_type == "whitelist":
+            count += (await self._count_whitelist_values([rule_id])).get(rule_id, 0)
+        if count >= SNAPSHOT_MIN_VALUES:
+            snapshot = await self._ensure_snapshot(rule)
+            ranges = None
+            if rule.match_type == "whitelist":
+                ranges = (await self._load_whitelist_values([rule_id], ranges_only=True))[rule_id]
+            rules_cache.put_rule(rule, ranges, snapshot)
+            return
+        
+        whitelist = None
+        if rule.match_type == "whitelist" and (reload_whitelist or not rules_cache.has_whitelist(rule_id)):
+            whitelist = (await self._load_whitelist_values([rule_id]))[rule_id]
+        rules_cache.put_rule(rule, whitelist)
     
-    async def check_ip_match(self, rule: GrayRuleDB, request: GrayDecisionRequest) -> bool:
-        """检查 IP 匹配"""
-        if not request.ip or not rule.match_values:
-            return False
-        return request.ip in rule.match_values
+    async def _reload_whitelist_entries(self, whitelist_changes: Dict[int, int]):
+        """whitelist_changes: {白名单ID: 规则ID}"""
+        whitelist_changes = {
+            wid: rid for wid, rid in whitelist_changes.items() if rules_cache.has_rule(rid)
+        }
+        if not whitelist_changes:
+            return
+        result = await self.session.execute(
+            select(
+                WhitelistDB.id, WhitelistDB.rule_id, WhitelistDB.value,
+                WhitelistDB.value_type, WhitelistDB.is_enabled,
+            )
+            .where(WhitelistDB.id.in_(list(whitelist_changes)))
+        )
+        found = set()
+        for whitelist_id, rule_id, value, value_type, is_enabled in result:
+            found.add(whitelist_id)
+            if is_enabled:
+                rules_cache.put_whitelist_entry(rule_id, whitelist_id, value, value_type)
+            else:
+                rules_cache.remove_whitelist_entry(rule_id, whitelist_id)
+        for whitelist_id, rule_id in whitelist_changes.items():
+            if whitelist_id not in found:
+                rules_cache.remove_whitelist_entry(rule_id, whitelist_id)
+    
+    async def get_plan(self) -> DecisionPlan:
+        """获取当前规则集的决策计划（仅在缓存未加载时访问数据库）"""
+        return await ensure_plan()
     
-    async def make_decision(self, request: GrayDecisionRequest) -> GrayDecisionResponse:
+    async def make_decision(self, request: GrayDecisionRequest, source: str = "decide") -> GrayDecisionResponse:
         """
         做出灰度决策
         
         决策流程:
-        1. 获取所有启用的规则（按优先级排序）
-        2. 按顺序匹配规则
+        1. 获取当前规则集编译好的决策计划（按优先级排序）
+        2. 同步顺序执行匹配器
         3. 返回第一个匹配的规则结果
         4. 无匹配则返回默认版本（stable）
+
+        source 为调用入口，记录在决策审计日志中。
         """
-        rules = await self.get_all_enabled_rules()
-        
-        for rule in rules:
-            matched = False
-            
-            if rule.match_type == "whitelist":
-                matched = await self.check_whitelist_match(rule, request)
-            elif rule.match_type == "header":
-                matched = await self.check_header_match(rule, request)
-            elif rule.match_type == "cookie":
-                matched = await self.check_cookie_match(rule, request)
-            elif rule.match_type == "ip":
-                matched = await self.check_ip_match(rule, request)
-            
-            if matched:
-                return GrayDecisionResponse(
-                    should_gray=True,
-                    target_version=rule.target_version,
-                    target_upstream=rule.target_upstream,
-                    matched_rule=rule.name,
-                    reason=f"Matched rule: {rule.name} ({rule.match_type})"
-                )
+        plan = await self.get_plan()
+        inp = DecisionInput.from_request(request)
+        rule = decision_cache.evaluate(plan, inp)
+        decision_log.record(plan, inp, rule, source)
+        shadow_evaluator.submit(plan, inp, rule, source)  # 影子规则在后台评估
+        return self.decision_response(rule)
+
+    @staticmethod
+    def decision_response(rule: Optional[CompiledRule]) -> GrayDecisionResponse:
+        if rule is not None:
+            return GrayDecisionResponse(
+                should_gray=True,
+                target_version=rule.target_version,
+                target_upstream=rule.target_upstream,
+                matched_rule=rule.name,
+                reason=rule.reason
+            )
         
         # 默认返回稳定版本
         return GrayDecisionResponse(
@@ -205,3 +600,59 @@ class GrayService:
             reason="No rule matched, default to stable"
         )
 
+    async def decide_batch(self, items: Iterable[Any]) -> AsyncIterator[dict]:
+        """
+        批量决策
+
+        先取定决策计划，整批请求都使用这一份计划（同一规则集版本），返回逐条产出结果的异步迭代器。
+        """
+        plan = await self.get_plan()
+        return iter_batch_decisions(plan, items)
+
+
+async def iter_batch_decisions(plan: DecisionPlan, items: Iterable[Any]) -> AsyncIterator[dict]:
+    """
+    按同一份决策计划逐条决策，最后产出一条汇总：总数、灰度数、无效条目数以及每条规则的命中次数。
+    批量请求通常是一次性的大名单，不经过决策结果缓存，避免挤掉线上请求的缓存项。
+    """
+    rule_counts: Dict[int, int] = {}
+    total = gray = invalid = 0
+    for item in items:
+        index = total
+        total += 1
+        if not index % 1000:
+            # 大批量时定期让出事件循环，不阻塞线上决策请求
+            await asyncio.sleep(0)
+        try:
+            request = GrayDecisionRequest.model_validate(item)
+        except ValidationError as exc:
+            invalid += 1
+            yield {"index": index, "error": exc.errors(include_url=False)[0]["msg"]}
+            continue
+        try:
+            rule = plan.evaluate(DecisionInput.from_request(request))
+        except (TypeError, ValueError, AttributeError) as exc:
+            # 单条异常输入不能中断整个响应流，汇总行必须送达
+            invalid += 1
+            yield {"index": index, "error": str(exc)}
+            continue
+        result = {"index": index, "user_id": request.user_id}
+        result.update(GrayService.decision_response(rule).model_dump(exclude={"reason"}))
+        if rule is not None:
+            gray += 1
+            rule_counts[rule.id] = rule_counts.get(rule.id, 0) + 1
+        yield result
+
+    yield {
+        "summary": {
+            "version": plan.version,
+            "total": total,
+            "gray": gray,
+            "stable": total - gray - invalid,
+            "invalid": invalid,
+            "rules": [
+                {"rule_id": rule.id, "name": rule.name, "matched": rule_counts[rule.id]}
+                for rule in plan.rules if rule.id in rule_counts
+            ],
+        }
+    }
@@ -0,0 +1,117 @@
+"""IP 地址工具与网段前缀树
+
+- normalize_ip / extract_client_ip：规范化客户端 IP（含 X-Forwarded-For 解析）
+- parse_ip_range：把 CIDR（10.0.0.0/8）或区间（10.0.0.1-10.0.0.50）解析成网段列表
+- IpPrefixTrie：按位展开的前缀树，查找耗时只与前缀长度有关（IPv4 ≤ 32 步，IPv6 ≤ 128 步），与网段数量无关
+"""
+from typing import List, Optional, Union
+import ipaddress
+
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+def parse_ip(value: Optional[str]) -> Optional[IPAddress]:
+    """解析 IP（容忍端口、方括号、引号），IPv4 映射的 IPv6 地址转成 IPv4，无效返回 None"""
+    if not value:
+        return None
+    value = value.strip().strip('"')
+    if value.startswith("["):
+        # [::1]:8080
+        value = value[1:value.find("]")] if "]" in value else value[1:]
+    elif value.count(":") == 1:
+        # 1.2.3.4:5678
+        value = value.split(":", 1)[0]
+    try:
+        address = ipaddress.ip_address(value)
+    except ValueError:
+        return None
+    if address.version == 6 and address.ipv4_mapped is not None:
+        return address.ipv4_mapped
+    return address
+
+
+def normalize_ip(value: Optional[str]) -> Optional[str]:
+    """IP 的规范字符串形式；无法解析时原样返回，保证精确匹配行为不变"""
+    address = parse_ip(value)
+    return str(address) if address is not None else value
+
+
+def extract_client_ip(x_real_ip: Optional[str], x_forwarded_for: Optional[str]) -> Optional[str]:
+    """
+    提取客户端 IP
+
+    优先使用 X-Real-IP；否则取 X-Forwarded-For 中第一个合法地址（跳过 unknown、空项等）。
+    """
+    address = parse_ip(x_real_ip)
+    if address is None and x_forwarded_for:
+        for item in x_forwarded_for.split(","):
+            address = parse_ip(item)
+            if address is not None:
+                break
+    return str(address) if address is not None else None
+
+
+def parse_ip_range(value: str) -> Optional[List[IPNetwork]]:
+    """解析 CIDR 或 `起始-结束` 区间，单个 IP 或非法值返回 None"""
+    value = value.strip()
+    try:
+        if "/" in value:
+            return [ipaddress.ip_network(value, strict=False)]
+        if "-" in value:
+            start, end = (ipaddress.ip_address(part.strip()) for part in value.split("-", 1))
+            return list(ipaddress.summarize_address_range(start, end))
+    except (ValueError, TypeError):
+        return None
+    return None
+
+
+class IpPrefixTrie:
+    """
+    网段前缀树
+
+    每个网段挂一个整数 payload（如规则在计划中的位置），查找返回沿途命中网段的最小 payload。
+    节点是 [0 分支, 1 分支, payload] 三元列表。
+    """
+    __slots__ = ("_roots", "size")
+
+    def __init__(self):
+        self._roots = {4: [None, None, None], 6: [None, None, None]}
+        self.size = 0
+
+    def insert(self, network: IPNetwork, payload: int = 0):
+        node = self._roots[network.version]
+        bits = network.max_prefixlen
+        value = int(network.network_address)
+        for i in range(network.prefixlen):
+            bit = (value >> (bits - 1 - i)) & 1
+            child = node[bit]
+            if child is None:
+                child = node[bit] = [None, None, None]
+            node = child
+        if node[2] is None or payload < node[2]:
+            node[2] = payload
+        self.size += 1
+
+    def lookup(self, address: Optional[IPAddress]) -> Optional[int]:
+        if address is None or not self.size:
+            return None
+        node = self._roots[address.version]
+        best = node[2]
+        value = int(address)
+        shift = address.max_prefixlen - 1
+        while shift >= 0:
+            node = node[(value >> shift) & 1]
+            if node is None:
+                break
+            payload = node[2]
+            if payload is not None and (best is None or payload < best):
+                best = payload
+            shift -= 1
+        return best
+
+    def __contains__(self, address: Optional[IPAddress]) -> bool:
+        return self.lookup(address) is not None
+
+    def __len__(self) -> int:
+        return self.size
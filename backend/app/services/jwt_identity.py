@@ -0,0 +1,86 @@
+"""JWT cookie 身份解析
+
+cookie 形如 `JWT <token>`（可能经过 URL 编码），取 payload.data 中的 cname / name 作为身份。
+解码结果按原始 cookie 值缓存在有界 LRU 中，缓存项不会超过 token 的 exp；
+已过期的 token 不再视为任何身份。
+"""
+from collections import OrderedDict
+from typing import Optional, Tuple
+from urllib.parse import unquote
+import time
+import jwt
+
+from config import JWT_CACHE_SIZE
+from .metrics import registry
+
+
+def decode_identities(cookie_value: str) -> Tuple[Tuple[str, ...], Optional[float]]:
+    """解码 cookie，返回 (身份元组, exp)；非 JWT 或解析失败返回空元组"""
+    cookie_value = unquote(cookie_value)
+    if not cookie_value.startswith("JWT"):
+        return (), None
+    try:
+        token = cookie_value.split(" ")[1]
+        payload = jwt.decode(token, options={"verify_signature": False})
+        data = payload["data"]
+        exp = payload.get("exp")
+        return (data["cname"], data["name"]), float(exp) if exp is not None else None
+    except (jwt.PyJWTError, IndexError, KeyError, TypeError, ValueError):
+        return (), None
+
+
+class JwtIdentityCache:
+    """按原始 cookie 值缓存解码出的身份（有界 LRU）"""
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Tuple[Tuple[str, ...], Optional[float]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0  # 等于实际调用 jwt.decode 的次数
+        self.failures = 0  # 非 JWT 或解析失败
+
+    def get(self, cookie_value: str) -> Tuple[str, ...]:
+        entries = self._entries
+        entry = entries.get(cookie_value)
+        if entry is not None:
+            identities, exp = entry
+            if exp is None or exp > time.time():
+                self.hits += 1
+                entries.move_to_end(cookie_value)
+                return identities
+            del entries[cookie_value]
+            return ()
+
+        self.misses += 1
+        identities, exp = decode_identities(cookie_value)
+        if not identities:
+            self.failures += 1
+        if exp is not None and exp <= time.time():
+            return ()
+        if self.maxsize > 0:
+            entries[cookie_value] = (identities, exp)
+            if len(entries) > self.maxsize:
+                entries.popitem(last=False)
+        return identities
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+
+# 全局缓存实例
+jwt_identity_cache = JwtIdentityCache(JWT_CACHE_SIZE)
+
+registry.callback("gray_jwt_cache_entries", "JWT 身份缓存当前条目数", lambda: len(jwt_identity_cache))
+registry.callback("gray_jwt_cache_hits_total", "JWT 身份缓存命中次数", lambda: jwt_identity_cache.hits, "counter")
+registry.callback("gray_jwt_decodes_total", "实际执行 JWT 解码的次数", lambda: jwt_identity_cache.misses, "counter")
+registry.callback(
+    "gray_jwt_decode_failures_total", "非 JWT 或解码失败的 cookie 数", lambda: jwt_identity_cache.failures, "counter"
+)
+
+
+def decode_jwt_identities(cookie_value: str) -> Tuple[str, ...]:
+    """从 `JWT <token>` 形式的 cookie 中取出 (cname, name)，非 JWT、解析失败或已过期返回空元组"""
+    return jwt_identity_cache.get(cookie_value)
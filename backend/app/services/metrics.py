@@ -0,0 +1,226 @@
+"""进程内指标（Prometheus 文本格式）
+
+每个 worker 进程各自计数，由 /metrics 输出；多 worker 部署时按进程抓取（或在 Prometheus 侧聚合）。
+计数只在事件循环线程内更新，都是普通的字典/列表自增，不加锁。
+缓存大小等现成的状态不在热路径上维护，而是注册回调，抓取时再读取。
+"""
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple, Union
+import time
+
+from sqlalchemy import event
+
+CONTENT_TYPE = "text/plain; version=0.0.4"  # Starlette 会补上 charset
+
+# 决策耗时：缓存命中约 1µs，未命中随规则数增长
+LATENCY_BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 1e-2, 5e-2, 0.25,
+)
+# 数据库查询、缓存重载
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+LabelValues = Tuple
+Sample = Union[float, Iterable[Tuple[LabelValues, float]]]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Counter:
+    """单调递增计数器；标签值按原样保存，输出时才转成字符串"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self) -> List[str]:
+        return [
+            f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+            for labels, value in sorted(self._values.items(), key=lambda item: tuple(map(str, item[0])))
+        ]
+
+
+class HistogramChild:
+    """单组标签的直方图"""
+    __slots__ = ("upper_bounds", "counts", "sum")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)  # 最后一个是 +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram:
+    """累积分桶直方图；热路径上先用 labels() 取出子直方图并保存，避免每次查字典"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._children: Dict[LabelValues, HistogramChild] = {}
+
+    def labels(self, *values) -> HistogramChild:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = HistogramChild(self.buckets)
+        return child
+
+    def observe(self, value: float, *labels):
+        self.labels(*labels).observe(value)
+
+    def collect(self) -> List[str]:
+        lines = []
+        for labels, child in sorted(self._children.items(), key=lambda item: tuple(map(str, item[0]))):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(child.sum)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class CallbackMetric:
+    """抓取时才读取的指标：fn 返回数值，或 (标签值元组, 数值) 的序列"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        fn: Callable[[], Sample],
+        kind: str = "gauge",
+        labelnames: Sequence[str] = (),
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+
+    def collect(self) -> List[str]:
+        sample = self.fn()
+        if not self.labelnames:
+            return [f"{self.name} {_number(sample)}"]
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in sample]
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"指标 {metric.name} 已注册")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(
+        self, name: str, documentation: str, fn: Callable[[], Sample], kind: str = "gauge", labelnames: Sequence[str] = ()
+    ) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, fn, kind, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+# 全局注册表
+registry = Registry()
+
+# ===== 决策 =====
+
+decision_duration = registry.histogram(
+    "gray_decision_duration_seconds",
+    "规则匹配耗时，按决策来源区分（hit/miss: 决策缓存命中/未命中，direct: 不经缓存直接匹配）",
+    ("source",),
+)
+rule_matches = registry.counter("gray_rule_matches_total", "按规则统计的命中次数", ("rule_id",))
+stable_decisions = registry.counter("gray_stable_decisions_total", "未命中任何规则（走稳定版）的决策次数")
+
+
+def count_decision(rule):
+    """按决策结果计数（rule 为 None 表示稳定版）"""
+    if rule is None:
+        stable_decisions.inc()
+    else:
+        rule_matches.inc(rule.id)
+
+# ===== 规则缓存 =====
+
+rules_cache_reload_duration = registry.histogram(
+    "gray_rule_cache_reload_seconds",
+    "规则缓存加载耗时（full: 整体加载，incremental: 增量同步）",
+    ("kind",),
+    DURATION_BUCKETS,
+)
+
+# ===== 数据库 =====
+
+db_query_duration = registry.histogram(
+    "gray_db_query_duration_seconds", "数据库语句执行耗时", ("operation",), DURATION_BUCKETS,
+)
+_DB_OPERATIONS = {"select", "insert", "update", "delete"}
+
+
+def instrument_engine(engine):
+    """为异步引擎注册语句计时（游标执行前后的事件）"""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._gray_query_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._gray_query_started
+        operation = statement.lstrip()[:6].lower()
+        db_query_duration.observe(elapsed, operation if operation in _DB_OPERATIONS else "other")
@@ -0,0 +1,281 @@
+"""把启用的规则导出为 Nginx map / geo 配置（零 BFF 路由模式）
+
+IP、Header 等值可枚举的规则可以完全由 Nginx 判定，不必发起 auth_request 子请求。
+导出文件（http 级 include）按优先级把规则串成一条变量链：
+
+    每条规则一个变量 $gray_rule_<id>：命中时取规则 ID，否则取下一条规则的变量；
+    链尾为 0（确定走稳定版）；
+    遇到无法表达的规则时链在此截断，取空串，表示需要回退到 auth_request。
+
+最终结果在 $gray_rule_id 中，$gray_export_target / $gray_export_upstream 给出对应的目标版本和上游。
+文件同时给出静态资源的上游白名单 $gray_static_backend（所有启用规则的 target_upstream），
+未签名的 gray_backend cookie 只有取值在白名单中时才会被采用，因此即使不启用零 BFF 模式也需要 include。
+
+Nginx map 的字符串匹配不区分大小写，而 BFF 的白名单 / header 匹配区分大小写。
+精确值因此分两步判定：先用 map 查出候选值（哈希查找），再用一条正则比较请求值与候选值是否完全相同：
+
+    map $http_x_beta $gray_rule_1_value { default ""; "On" "On"; }
+    map "$http_x_beta:$gray_rule_1_value" $gray_rule_1 { default <下一条>; "~^([^:]+):\\1$" 1; }
+
+分隔符取规则的值中都不包含的字符，请求值中出现分隔符时不可能命中，因此无法伪造匹配。
+同一规则中仅大小写不同的值（map 无法区分）、包含 $ 的值（map 结果会被当作变量）
+或用尽了所有候选分隔符的值无法表达。
+
+无法表达的规则：
+- cookie：需要解码 JWT 后比对身份；
+- percentage：Nginx split_clients 的哈希与 BFF 的分桶不一致；
+- 未知的匹配类型。
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+import os
+import re
+import tempfile
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models import GrayRuleDB
+from .decision_plan import split_ip_values, split_whitelist_values
+from .gray_service import GrayService
+from .ip_index import parse_ip
+
+_HEADER_NAME = re.compile(r"^[A-Za-z0-9-]+$")
+_SPECIAL_KEYS = {"default", "hostnames", "include", "volatile"}
+_SEPARATORS = ":@#!=,"
+
+
+def _quote(value: str) -> str:
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def _map_key(value: str) -> str:
+    # 以 ~ 开头会被当作正则，与 map 参数同名的值也需要转义
+    if value.startswith("~") or value in _SPECIAL_KEYS:
+        value = "\\" + value
+    return _quote(value)
+
+
+def _is_plain(value: str) -> bool:
+    return all(ch >= " " and ch != "\x7f" for ch in value)
+
+
+class ExportReport:
+    """导出结果"""
+
+    def __init__(self, version: int):
+        self.version = version
+        self.exported: List[GrayRuleDB] = []
+        self.fallback: List[Tuple[GrayRuleDB, str]] = []  # 无法表达，回退 auth_request
+        self.shadowed: List[GrayRuleDB] = []  # 排在回退规则之后，同样交给 auth_request
+        self.static_upstreams: List[str] = []  # 静态资源允许的上游
+        self.skipped_upstreams: List[Tuple[GrayRuleDB, str]] = []  # 无法写入白名单的上游
+
+    def summary(self) -> str:
+        lines = [f"规则集版本 {self.version}：导出 {len(self.exported)} 条规则"]
+        for rule, reason in self.fallback:
+            lines.append(f"  回退 auth_request: [{rule.id}] {rule.name} ({rule.match_type}) - {reason}")
+        for rule in self.shadowed:
+            lines.append(f"  未导出（优先级低于回退规则）: [{rule.id}] {rule.name} ({rule.match_type})")
+        lines.append(f"静态资源上游白名单 {len(self.static_upstreams)} 个")
+        for rule, upstream in self.skipped_upstreams:
+            lines.append(f"  未加入白名单（包含 $）: [{rule.id}] {rule.name} - {upstream}")
+        return "\n".join(lines)
+
+
+def _render_map(source: str, name: str, keys: Iterable[str], hit: str, default: str) -> List[str]:
+    lines = [f"map {source} ${name} {{", f"    default {default};"]
+    lines.extend(f"    {_map_key(key)} {hit};" for key in sorted(keys))
+    lines.append("}")
+    return lines
+
+
+def _separator(values: Iterable[str]) -> Optional[str]:
+    used = set("".join(values))
+    return next((sep for sep in _SEPARATORS if sep not in used), None)
+
+
+def _render_exact_match(source: str, name: str, values: Iterable[str], hit: str, default: str) -> List[str]:
+    """区分大小写的精确匹配：map 查出候选值，再用反向引用正则确认与请求值完全相同"""
+    sep = _separator(values)
+    lines = [f"map {source} ${name}_value {{", '    default "";']
+    lines.extend(f"    {_map_key(value)} {_quote(value)};" for value in sorted(values))
+    lines.append("}")
+    lines.append(f'map "{source}{sep}${name}_value" ${name} {{')
+    lines.append(f"    default {default};")
+    lines.append(f'    "~^([^{sep}]+){sep}\\1$" {hit};')
+    lines.append("}")
+    return lines
+
+
+def _value_problem(values: Iterable[str]) -> Optional[str]:
+    """精确值无法在 Nginx 中区分大小写匹配的原因"""
+    folded = set()
+    for value in values:
+        if "$" in value:
+            return "值包含 $"
+        key = value.lower()
+        if key in folded:
+            return "值仅大小写不同，Nginx map 无法区分"
+        folded.add(key)
+    if _separator(values) is None:
+        return "值包含所有候选分隔符"
+    return None
+
+
+def _render_geo(name: str, networks: Iterable[str]) -> List[str]:
+    lines = [f"geo ${name} {{", "    default 0;"]
+    lines.extend(f"    {network} 1;" for network in sorted(networks))
+    lines.append("}")
+    return lines
+
+
+def _rule_inputs(
+    rule: GrayRuleDB, whitelist: Iterable[Tuple[str, str]]
+) -> Tuple[Optional[Tuple[str, set, set]], Optional[str]]:
+    """
+    规则在 Nginx 中的判定输入：((变量, 精确值, 网段), None)，无法表达时返回 (None, 原因)
+
+    变量为空串表示规则只按客户端地址（geo）判定。
+    """
+    match_type = rule.match_type
+    if rule.active_from or rule.active_until or rule.rollout_steps:
+        return None, "定时规则需要 BFF 判定生效时间"
+    if match_type == "whitelist":
+        user_values, ip_values, ip_ranges = split_whitelist_values(rule.match_values or (), whitelist)
+        networks = {str(n) for n in ip_ranges}
+        networks.update(v for v in ip_values if parse_ip(v) is not None)
+        return ("user", user_values, networks), None
+    if match_type == "ip":
+        ip_values, ip_ranges = split_ip_values(rule.match_values or ())
+        networks = {str(n) for n in ip_ranges}
+        networks.update(v for v in ip_values if parse_ip(v) is not None)
+        return ("", set(), networks), None
+    if match_type == "header":
+        if not rule.match_key or not _HEADER_NAME.match(rule.match_key):
+            return None, "header 名称无法转换为 Nginx 变量"
+        variable = "$http_" + rule.match_key.lower().replace("-", "_")
+        return (variable, set(rule.match_values or ()), set()), None
+    if match_type == "cookie":
+        return None, "cookie 规则需要解码 JWT"
+    if match_type == "percentage":
+        return None, "百分比分桶哈希与 Nginx split_clients 不一致"
+    return None, f"未知的匹配类型 {match_type}"
+
+
+def render_nginx_rules(
+    rules: List[GrayRuleDB],
+    whitelists: Dict[int, Iterable[Tuple[str, str]]],
+    version: int,
+    user_var: str = "$cookie_username",
+) -> Tuple[str, ExportReport]:
+    """渲染 include 文件内容，rules 需为启用的线上规则（不含影子规则）"""
+    report = ExportReport(version)
+    rules = sorted(rules, key=lambda r: (-r.priority, r.id))
+
+    chain = []
+    for index, rule in enumerate(rules):
+        inputs, reason = _rule_inputs(rule, whitelists.get(rule.id, ()))
+        if inputs is not None:
+            variable, values, networks = inputs
+            values = {v for v in values if v and _is_plain(v)}
+            reason = _value_problem(values)
+        if inputs is not None and reason is None:
+            if variable == "user":
+                variable = user_var
+            if not values and not networks:
+                # 不可能命中的规则，不占用链节点
+                continue
+            chain.append((rule, variable, values, networks))
+            report.exported.append(rule)
+            continue
+        report.fallback.append((rule, reason))
+        report.shadowed.extend(rules[index + 1:])
+        break
+
+    lines = [
+        "# 由 `python -m app.cli export-nginx` 生成，请勿手工修改",
+        f"# 规则集版本: {version}",
+        "",
+    ]
+    tail = '""' if report.fallback else "0"
+    for position, (rule, variable, values, networks) in enumerate(chain):
+        name = f"gray_rule_{rule.id}"
+        following = f"$gray_rule_{chain[position + 1][0].id}" if position + 1 < len(chain) else tail
+        lines.append(f"# [{rule.id}] {rule.name} ({rule.match_type}, priority {rule.priority})")
+        if networks:
+            # geo 的值不能引用变量：先得到 0/1，再用 map 接到链上
+            ip_name = f"{name}_ip" if values else name
+            if values:
+                lines.extend(_render_exact_match(variable, name, values, str(rule.id), f"${ip_name}"))
+            lines.extend(_render_geo(f"{name}_ip_hit", networks))
+            lines.extend(_render_map(f"${name}_ip_hit", ip_name, ("1",), str(rule.id), following))
+        else:
+            lines.extend(_render_exact_match(variable, name, values, str(rule.id), following))
+        lines.append("")
+
+    first = f"$gray_rule_{chain[0][0].id}" if chain else tail
+    lines.append("# 最终决策：规则 ID；0 为稳定版；空串表示回退 auth_request")
+    lines.append(f"map {first} $gray_rule_id {{")
+    lines.append(f"    default {first};")
+    lines.append("}")
+    lines.append("")
+
+    lines.append("map $gray_rule_id $gray_export_target {")
+    lines.append('    default "";')
+    lines.append("    0 stable;")
+    lines.extend(f"    {rule.id} {_quote(rule.target_version)};" for rule, *_ in chain)
+    lines.append("}")
+    lines.append("")
+    lines.append("map $gray_rule_id $gray_export_upstream {")
+    lines.append('    default "";')
+    lines.extend(
+        f"    {rule.id} {_quote(rule.target_upstream)};" for rule, *_ in chain if rule.target_upstream
+    )
+    lines.append("}")
+    lines.append("")
+
+    # 静态资源上游白名单：覆盖所有启用规则，与规则能否在 Nginx 中表达无关
+    upstreams = set()
+    for rule in rules:
+        if not rule.target_upstream:
+            continue
+        if "$" in rule.target_upstream or not _is_plain(rule.target_upstream):
+            report.skipped_upstreams.append((rule, rule.target_upstream))
+            continue
+        upstreams.add(rule.target_upstream)
+    report.static_upstreams = sorted(upstreams)
+    lines.append("# 静态资源上游白名单：gray_backend cookie 只接受这些取值，其余回退稳定版")
+    lines.append("map $cookie_gray_backend $gray_static_backend {")
+    lines.append('    default "";')
+    lines.extend(f"    {_map_key(upstream)} {_quote(upstream)};" for upstream in report.static_upstreams)
+    lines.append("}")
+    lines.append("")
+    return "\n".join(lines), report
+
+
+def write_atomic(path: str, content: str):
+    """临时文件 + 原子替换，Nginx reload 时不会读到写了一半的文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".gray_rules.")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+async def export_nginx_rules(session: AsyncSession, path: str, user_var: str = "$cookie_username") -> ExportReport:
+    """读取启用的规则并写出 include 文件"""
+    service = GrayService(session)
+    version = await service.get_rule_set_version()
+    rules = [rule for rule in await service.get_all_enabled_rules() if not rule.is_shadow]
+    whitelist_ids = [rule.id for rule in rules if rule.match_type == "whitelist"]
+    entries = await service._load_whitelist_values(whitelist_ids)
+    whitelists = {rule_id: list(items.values()) for rule_id, items in entries.items()}
+    content, report = render_nginx_rules(rules, whitelists, version, user_var)
+    write_atomic(path, content)
+    return report
@@ -0,0 +1,355 @@
+"""离线流量回放与规则影响模拟
+
+把 Nginx 访问日志（或 auth 子请求的 JSONL 抓包）逐行送入决策计划，
+统计候选规则集下每条规则的命中率、灰度/稳定版分流比例以及单次决策耗时分布。
+整个过程是生成器流水线（读行 -> 解析 -> 决策 -> 聚合），内存占用与日志大小无关。
+
+支持的输入格式：
+- jsonl：每行一个决策请求 {"user_id", "ip", "headers", "cookies"}，
+  也接受 Nginx 直接输出的原始 Cookie 头 {"cookie": "a=1; b=2"}，
+  可选的 "time" 为请求时间（秒级时间戳如 $msec，或 ISO 时间如 $time_iso8601）；
+- nginx：combined 格式，取 $remote_addr 为 IP、$remote_user 为用户ID，User-Agent / Referer 作为请求头，
+  $time_local 为请求时间。
+
+字段类型不符（如 user_id 为数字、headers 不是对象）的记录与无法解析的行一样计为 invalid，不中断回放。
+
+日志中的 JWT cookie 到回放时大多已过期，回放按签发时有效处理：解码身份时不检查 exp，
+也不使用线上的 JWT 身份缓存。候选规则集按完整时间线编译，定时规则按每条记录的请求时间取对应区间的计划，
+没有请求时间的记录按 at 时刻（默认当前时间）评估。
+"""
+from bisect import bisect_right
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import gzip
+import json
+import math
+import re
+import sys
+import time
+
+from pydantic import ValidationError
+
+from ..models import GrayDecisionRequest, GrayRuleCreate, GrayRuleDB
+from config import JWT_CACHE_SIZE
+from .decision_plan import DecisionInput, DecisionPlan, compile_plan
+from .ip_index import normalize_ip
+from .jwt_identity import decode_identities
+
+_COMBINED = re.compile(
+    r'^(?P<ip>\S+) \S+ (?P<user>\S+) \[(?P<time>[^\]]*)\] "(?P<request>[^"]*)" \d{3} \S+'
+    r'(?: "(?P<referer>[^"]*)" "(?P<agent>[^"]*)")?'
+)
+
+
+# ===== 规则集 =====
+
+def load_rules_file(path: str) -> DecisionPlan:
+    """
+    从 JSON 文件加载候选规则集并编译成决策计划
+
+    文件内容为规则数组（或 {"rules": [...]}），字段同创建规则接口；
+    可选 id（缺省按顺序编号）和 whitelist（字符串，或 {"value", "value_type"}）。
+    返回完整时间线的第一个区间，历史日志中的任意时刻都能经 next_plan 找到对应的计划。
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    items = data["rules"] if isinstance(data, dict) else data
+
+    rules = []
+    whitelists: Dict[int, List[Tuple[str, str]]] = {}
+    for index, item in enumerate(items, start=1):
+        rule_id = item.get("id", index)
+        fields = GrayRuleCreate.model_validate(
+            {k: v for k, v in item.items() if k not in ("id", "whitelist")}
+        )
+        if not fields.is_enabled:
+            continue
+        rules.append(GrayRuleDB(id=rule_id, **fields.model_dump()))
+        whitelists[rule_id] = [
+            (entry, "user_id") if isinstance(entry, str)
+            else (entry["value"], entry.get("value_type", "user_id"))
+            for entry in item.get("whitelist", ())
+        ]
+    return compile_plan(rules, whitelists, now=-math.inf)
+
+
+# ===== 输入流水线 =====
+
+@lru_cache(maxsize=JWT_CACHE_SIZE)
+def _replay_identities(cookie_value: str) -> Tuple[str, ...]:
+    return decode_identities(cookie_value)[0]
+
+
+class ReplayInput(DecisionInput):
+    """回放的请求：JWT cookie 身份不检查 exp（日志记录时 token 有效，回放时通常已过期）"""
+    __slots__ = ("ts",)
+
+    def __init__(
+        self,
+        user_id: Optional[str] = None,
+        ip: Optional[str] = None,
+        headers: Optional[dict] = None,
+        cookies: Optional[dict] = None,
+        ts: Optional[float] = None,
+    ):
+        super().__init__(user_id, ip, headers, cookies)
+        self.ts = ts  # 请求时间戳，未知时为 None
+
+    def cookie_identities(self, name: str) -> Tuple[str, ...]:
+        memo = self._identities
+        if memo is None:
+            memo = self._identities = {}
+        identities = memo.get(name)
+        if identities is None:
+            cookie_value = self.cookies.get(name)
+            identities = memo[name] = _replay_identities(cookie_value) if cookie_value else ()
+        return identities
+
+
+def read_lines(path: str) -> Iterator[str]:
+    """逐行读取日志，支持 .gz 和标准输入（-）"""
+    if path == "-":
+        yield from sys.stdin
+        return
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+        yield from f
+
+
+def _parse_cookie_header(cookie_header: str) -> dict:
+    cookies = {}
+    for item in cookie_header.split(";"):
+        name, sep, value = item.partition("=")
+        if sep:
+            cookies[name.strip()] = value.strip().strip('"')
+    return cookies
+
+
+def _parse_iso_time(value: str) -> float:
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _record_time(value) -> float:
+    """jsonl 的 time 字段：秒级时间戳（数字或数字字符串）或 ISO 时间，无效时抛出 ValueError"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(value)
+    try:
+        ts = float(value)
+    except ValueError:
+        ts = _parse_iso_time(value)
+    if not math.isfinite(ts):
+        raise ValueError(value)
+    return ts
+
+
+@lru_cache(maxsize=4096)
+def _nginx_time(value: str) -> Optional[float]:
+    """$time_local（10/Oct/2000:13:55:36 -0700），同一秒的请求共用解析结果"""
+    try:
+        return datetime.strptime(value, "%d/%b/%Y:%H:%M:%S %z").timestamp()
+    except ValueError:
+        return None
+
+
+def parse_jsonl(line: str) -> Optional[DecisionInput]:
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict):
+        return None
+    # 字段类型与决策接口一致，校验失败的记录计为无法解析
+    try:
+        request = GrayDecisionRequest.model_validate(record)
+    except ValidationError:
+        return None
+    cookie_header = record.get("cookie")
+    if cookie_header is not None and not isinstance(cookie_header, str):
+        return None
+    ts = None
+    if record.get("time") is not None:
+        try:
+            ts = _record_time(record["time"])
+        except ValueError:
+            return None
+    cookies = request.cookies
+    if cookies is None and cookie_header:
+        cookies = _parse_cookie_header(cookie_header)
+    headers = request.headers or {}
+    return ReplayInput(
+        request.user_id or None,
+        normalize_ip(request.ip),
+        {k.lower(): v for k, v in headers.items()},
+        cookies or {},
+        ts,
+    )
+
+
+def parse_nginx(line: str) -> Optional[DecisionInput]:
+    match = _COMBINED.match(line)
+    if match is None:
+        return None
+    headers = {}
+    if match["agent"] and match["agent"] != "-":
+        headers["user-agent"] = match["agent"]
+    if match["referer"] and match["referer"] != "-":
+        headers["referer"] = match["referer"]
+    user = match["user"]
+    return ReplayInput(
+        user if user != "-" else None, normalize_ip(match["ip"]), headers, ts=_nginx_time(match["time"])
+    )
+
+
+PARSERS = {"jsonl": parse_jsonl, "nginx": parse_nginx}
+
+
+def parse_records(lines: Iterable[str], fmt: str) -> Iterator[Optional[DecisionInput]]:
+    """逐行解析，空行跳过，无法解析的行产出 None"""
+    parser = PARSERS[fmt]
+    for line in lines:
+        if line.strip():
+            yield parser(line)
+
+
+# ===== 统计 =====
+
+class LatencyHistogram:
+    """对数分桶的耗时直方图（相邻桶相差约 5%），分位数误差与样本量无关"""
+
+    RATIO = math.log(1.05)
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.max_ns = 0
+
+    def record(self, ns: int):
+        bucket = int(math.log(ns) / self.RATIO) if ns > 0 else 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def percentile(self, q: float) -> float:
+        """第 q 分位（0-100）的耗时，单位纳秒（取桶上界）"""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * q / 100)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(math.exp((bucket + 1) * self.RATIO), self.max_ns)
+        return float(self.max_ns)
+
+
+class ReplayReport:
+    """回放统计"""
+
+    def __init__(self, plan: DecisionPlan):
+        self.plan = plan
+        self.total = 0
+        self.invalid = 0
+        self.gray = 0
+        self.rule_hits: Dict[int, int] = {}
+        self.latency = LatencyHistogram()
+        self.elapsed = 0.0
+
+    def rules(self) -> List:
+        """时间线各区间出现过的规则（同一规则只列一次）"""
+        rules = {}
+        plan = self.plan
+        while plan is not None:
+            for rule in plan.rules:
+                rules.setdefault(rule.id, rule)
+            plan = plan.next_plan
+        return sorted(rules.values(), key=lambda r: (-r.priority, r.id))
+
+    def to_dict(self) -> dict:
+        decided = self.total - self.invalid
+        rate = (lambda n: round(n / decided, 6) if decided else 0.0)
+        return {
+            "total": self.total,
+            "invalid": self.invalid,
+            "gray": self.gray,
+            "stable": decided - self.gray,
+            "gray_rate": rate(self.gray),
+            "rules": [
+                {
+                    "rule_id": rule.id,
+                    "name": rule.name,
+                    "match_type": rule.match_type,
+                    "hits": self.rule_hits.get(rule.id, 0),
+                    "hit_rate": rate(self.rule_hits.get(rule.id, 0)),
+                }
+                for rule in self.rules()
+            ],
+            "latency_us": {
+                "p50": round(self.latency.percentile(50) / 1000, 3),
+                "p90": round(self.latency.percentile(90) / 1000, 3),
+                "p99": round(self.latency.percentile(99) / 1000, 3),
+                "max": round(self.latency.max_ns / 1000, 3),
+            },
+            "elapsed_seconds": round(self.elapsed, 3),
+        }
+
+    def summary(self) -> str:
+        data = self.to_dict()
+        lines = [
+            f"请求 {data['total']}（无法解析 {data['invalid']}）",
+            f"灰度 {data['gray']} ({data['gray_rate']:.2%})  稳定版 {data['stable']}",
+            "规则命中：",
+        ]
+        for item in data["rules"]:
+            lines.append(
+                f"  [{item['rule_id']}] {item['name']} ({item['match_type']}): "
+                f"{item['hits']} ({item['hit_rate']:.2%})"
+            )
+        latency = data["latency_us"]
+        lines.append(
+            f"决策耗时 (µs): p50 {latency['p50']}  p90 {latency['p90']}  "
+            f"p99 {latency['p99']}  max {latency['max']}"
+        )
+        lines.append(f"总耗时 {data['elapsed_seconds']}s")
+        return "\n".join(lines)
+
+
+def replay(
+    plan: DecisionPlan, records: Iterable[Optional[DecisionInput]], at: Optional[float] = None
+) -> ReplayReport:
+    """
+    把解析后的请求流逐条送入决策计划并汇总
+
+    每条记录按其请求时间选择时间线上对应区间的计划（日志不要求按时间排序），
+    没有请求时间的记录使用 at 时刻（默认当前时间）的计划。
+    """
+    report = ReplayReport(plan)
+    rule_hits = report.rule_hits
+    record_latency = report.latency.record
+    segments = []
+    while plan is not None:
+        segments.append(plan)
+        plan = plan.next_plan
+    ends = [segment.valid_until for segment in segments]
+    fallback = segments[bisect_right(ends, time.time() if at is None else at)]
+    clock = time.perf_counter_ns
+    started = time.perf_counter()
+    for inp in records:
+        report.total += 1
+        if inp is None:
+            report.invalid += 1
+            continue
+        ts = getattr(inp, "ts", None)
+        segment = fallback if ts is None else segments[bisect_right(ends, ts)]
+        begin = clock()
+        rule = segment.evaluate(inp)
+        record_latency(clock() - begin)
+        if rule is not None:
+            report.gray += 1
+            rule_hits[rule.id] = rule_hits.get(rule.id, 0) + 1
+    report.elapsed = time.perf_counter() - started
+    return report
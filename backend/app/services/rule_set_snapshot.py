@@ -0,0 +1,153 @@
+"""规则集快照（冷启动与数据库故障时的兜底）
+
+规则缓存每次发布新版本后，把启用的规则、进程内的白名单条目以及大规则的值快照版本
+写入一个带校验和的文件。worker 启动时先加载该文件（毫秒级，不查询 gray_rules / whitelists），
+再通过 rule_changes 增量追平数据库；数据库不可用时继续使用快照中的规则集。
+
+文件格式：
+    magic      4s   b"GRRS"
+    format     H    格式版本
+    version    Q    规则集版本（rule_changes 最大 id）
+    length     Q    负载字节数
+    checksum   32s  负载的 SHA-256
+    负载       zlib 压缩的 JSON {"rules": [...], "whitelists": {...}, "snapshots": {...}}
+
+校验和不符、负载截断或引用的值快照缺失/早于记录的版本时，快照视为无效，回退到数据库整体加载。
+"""
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import zlib
+
+from sqlalchemy import DateTime
+
+from config import RULE_SET_SNAPSHOT_PATH
+from ..models import GrayRuleDB
+from .snapshot import ValueSnapshot, open_snapshot
+
+MAGIC = b"GRRS"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sHQQ32s")
+_COLUMNS = tuple(GrayRuleDB.__table__.columns)
+
+
+def _rule_to_dict(rule: GrayRuleDB) -> dict:
+    data = {}
+    for column in _COLUMNS:
+        value = getattr(rule, column.name)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        data[column.name] = value
+    return data
+
+
+def _rule_from_dict(data: dict) -> GrayRuleDB:
+    values = {}
+    for column in _COLUMNS:
+        value = data.get(column.name)
+        if value is not None and isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        values[column.name] = value
+    return GrayRuleDB(**values)
+
+
+class RuleSetSnapshot:
+    """从文件读出的规则集"""
+
+    def __init__(
+        self,
+        version: int,
+        rules: list,
+        whitelists: Dict[int, Dict[int, Tuple[str, str]]],
+        snapshots: Dict[int, ValueSnapshot],
+    ):
+        self.version = version
+        self.rules = rules
+        self.whitelists = whitelists
+        self.snapshots = snapshots
+
+
+def read_version(path: str = RULE_SET_SNAPSHOT_PATH) -> int:
+    """只读文件头中的版本，文件不存在或无效时返回 0"""
+    try:
+        with open(path, "rb") as f:
+            magic, fmt, version, _, _ = _HEADER.unpack(f.read(_HEADER.size))
+    except (OSError, struct.error):
+        return 0
+    return version if magic == MAGIC and fmt == FORMAT_VERSION else 0
+
+
+def save_rule_set(
+    version: int,
+    rules,
+    whitelists: Dict[int, Dict[int, Tuple[str, str]]],
+    snapshot_versions: Dict[int, int],
+    path: str = RULE_SET_SNAPSHOT_PATH,
+    force: bool = False,
+) -> bool:
+    """
+    写入规则集快照（临时文件 + 原子替换）
+
+    其他 worker 已写入相同或更新的版本时跳过（force 时总是写入，用于从数据库整体加载后
+    覆盖损坏或来自其他数据库的快照），返回是否写入。
+    """
+    if not force and read_version(path) >= version:
+        return False
+    payload = zlib.compress(json.dumps({
+        "rules": [_rule_to_dict(rule) for rule in rules],
+        "whitelists": {
+            str(rule_id): [[whitelist_id, value, value_type] for whitelist_id, (value, value_type) in entries.items()]
+            for rule_id, entries in whitelists.items() if entries
+        },
+        "snapshots": {str(rule_id): snapshot_version for rule_id, snapshot_version in snapshot_versions.items()},
+    }, ensure_ascii=False, separators=(",", ":")).encode())
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".ruleset.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, version, len(payload), hashlib.sha256(payload).digest()))
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return True
+
+
+def load_rule_set(path: str = RULE_SET_SNAPSHOT_PATH) -> Optional[RuleSetSnapshot]:
+    """读取并校验规则集快照，不存在或无效时返回 None"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    try:
+        magic, fmt, version, length, checksum = _HEADER.unpack_from(data)
+        payload = data[_HEADER.size:]
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            raise ValueError("格式不匹配")
+        if len(payload) != length or hashlib.sha256(payload).digest() != checksum:
+            raise ValueError("校验和不符")
+        content = json.loads(zlib.decompress(payload))
+
+        snapshots = {}
+        for rule_id, required in content["snapshots"].items():
+            snapshot = open_snapshot(int(rule_id))
+            if snapshot is None or snapshot.version < required:
+                raise ValueError(f"规则 {rule_id} 的值快照缺失或过期")
+            snapshots[int(rule_id)] = snapshot
+        rules = [_rule_from_dict(item) for item in content["rules"]]
+        whitelists = {
+            int(rule_id): {whitelist_id: (value, value_type) for whitelist_id, value, value_type in entries}
+            for rule_id, entries in content["whitelists"].items()
+        }
+    except (struct.error, ValueError, KeyError, TypeError, zlib.error) as exc:
+        print(f"⚠️ Ignoring rule set snapshot {path}: {exc}")
+        return None
+    return RuleSetSnapshot(version, rules, whitelists, snapshots)
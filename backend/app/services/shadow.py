@@ -0,0 +1,83 @@
+"""影子规则评估
+
+影子规则（is_shadow）与线上规则一起编译成影子计划（DecisionPlan.shadow），但不参与路由。
+决策路径只把 (影子计划, 请求输入, 线上结果) 放入有界队列，由后台任务在请求返回后重新评估，
+统计影子规则假如上线会接管的流量，以及决策结果会因此改变的请求：
+
+- gray_shadow_rule_matches_total{rule_id}：影子计划的最终结果是该影子规则；
+- gray_shadow_changed_total{live, shadow}：影子计划与线上计划结果不同（规则 ID 或 stable）。
+
+结果不同的请求在开启决策审计日志时以 source="shadow:<入口>" 记录。
+队列满时丢弃并计数，不阻塞决策。
+"""
+from collections import deque
+from typing import Optional
+import asyncio
+
+from config import SHADOW_QUEUE_SIZE
+from .decision_log import decision_log
+from .decision_plan import CompiledRule, DecisionInput, DecisionPlan
+from .metrics import registry
+
+shadow_matches = registry.counter(
+    "gray_shadow_rule_matches_total", "影子规则假如上线后会命中的请求数", ("rule_id",)
+)
+shadow_changed = registry.counter(
+    "gray_shadow_changed_total", "影子计划与线上计划决策结果不同的请求数", ("live", "shadow")
+)
+
+
+class ShadowEvaluator:
+    """影子规则的后台评估队列"""
+
+    def __init__(self, maxsize: int = 10000, chunk_size: int = 500):
+        self.maxsize = maxsize
+        self.chunk_size = chunk_size  # 每评估这么多条让出一次事件循环
+        self._queue: deque = deque()
+        self._wakeup = asyncio.Event()
+        self.evaluated = 0
+        self.dropped = 0
+
+    def submit(self, plan: DecisionPlan, inp: DecisionInput, rule: Optional[CompiledRule], source: str):
+        """在请求路径上调用：没有影子规则时只做一次属性判断"""
+        shadow = plan.shadow
+        if shadow is None:
+            return
+        queue = self._queue
+        if len(queue) >= self.maxsize:
+            self.dropped += 1
+            return
+        queue.append((shadow, inp, rule, source))
+        self._wakeup.set()
+
+    def evaluate(self, shadow: DecisionPlan, inp: DecisionInput, live: Optional[CompiledRule], source: str):
+        result = shadow.evaluate(inp)
+        if result is not None and result.is_shadow:
+            shadow_matches.inc(result.id)
+        live_id = live.id if live is not None else None
+        shadow_id = result.id if result is not None else None
+        if live_id != shadow_id:
+            shadow_changed.inc(live_id or "stable", shadow_id or "stable")
+            decision_log.record(shadow, inp, result, f"shadow:{source}")
+        self.evaluated += 1
+
+    async def run(self):
+        """后台任务：队列非空时分块评估"""
+        queue = self._queue
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            processed = 0
+            while queue:
+                self.evaluate(*queue.popleft())
+                processed += 1
+                if processed % self.chunk_size == 0:
+                    await asyncio.sleep(0)
+
+
+# 全局实例
+shadow_evaluator = ShadowEvaluator(SHADOW_QUEUE_SIZE)
+
+registry.callback("gray_shadow_queue_size", "等待评估的影子请求数", lambda: len(shadow_evaluator._queue))
+registry.callback("gray_shadow_evaluations_total", "已完成的影子评估次数", lambda: shadow_evaluator.evaluated, "counter")
+registry.callback("gray_shadow_dropped_total", "队列满而丢弃的影子评估数", lambda: shadow_evaluator.dropped, "counter")
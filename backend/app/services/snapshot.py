@@ -0,0 +1,111 @@
+"""规则值快照（跨 worker 共享）
+
+值数量达到 SNAPSHOT_MIN_VALUES 的规则（白名单条目 + match_values）由写入方发布为只读快照文件，
+各 worker 以 mmap 只读映射同一文件，数据由操作系统页缓存在进程间共享，
+worker 不再各自持有一份值集合。
+
+快照按维度分段（白名单规则为 user_id / ip，其余规则为 values），
+每段是一个哈希白名单索引（Bloom 位图 + 有序哈希数组，见 whitelist_index）。
+
+文件格式：
+    magic      4s   b"GRVS"
+    format     H    格式版本
+    segments   H    段数
+    version    Q    发布时该规则的最新变更版本
+    段表       每段 name 8s / offset Q / bloom_bytes Q / count Q
+    段数据     bloom_bytes 字节位图 + count 个 uint64 哈希（本机字节序，升序）
+"""
+from typing import Dict, Iterable, Optional
+import mmap
+import os
+import struct
+import tempfile
+
+from config import SNAPSHOT_DIR
+from .whitelist_index import HashedValueSet, build_index
+
+MAGIC = b"GRVS"
+FORMAT_VERSION = 2
+_HEADER = struct.Struct("<4sHHQ")
+_SEGMENT = struct.Struct("<8sQQQ")
+
+
+def snapshot_path(rule_id: int) -> str:
+    return os.path.join(SNAPSHOT_DIR, f"rule_{rule_id}.bin")
+
+
+class ValueSnapshot:
+    """mmap 映射的规则值快照"""
+    __slots__ = ("version", "segments")
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mm) < _HEADER.size:
+            raise ValueError(f"snapshot too small: {path}")
+        magic, fmt, segment_count, version = _HEADER.unpack_from(mm)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            raise ValueError(f"invalid snapshot: {path}")
+
+        view = memoryview(mm)
+        self.version = version
+        self.segments: Dict[str, HashedValueSet] = {}
+        for i in range(segment_count):
+            name, offset, bloom_bytes, count = _SEGMENT.unpack_from(mm, _HEADER.size + i * _SEGMENT.size)
+            hashes_offset = offset + bloom_bytes
+            end = hashes_offset + count * 8
+            if end > len(mm):
+                raise ValueError(f"truncated snapshot: {path}")
+            self.segments[name.rstrip(b"\0").decode()] = HashedValueSet(
+                view[offset:hashes_offset],
+                view[hashes_offset:end].cast("Q"),
+            )
+
+    def segment(self, name: str) -> Optional[HashedValueSet]:
+        return self.segments.get(name)
+
+    def __len__(self) -> int:
+        return sum(len(s) for s in self.segments.values())
+
+
+def publish_snapshot(rule_id: int, version: int, segments: Dict[str, Iterable[str]]) -> str:
+    """写入规则的值快照（临时文件 + 原子替换），返回文件路径"""
+    built = [(name, *build_index(values)) for name, values in segments.items()]
+
+    offset = _HEADER.size + len(built) * _SEGMENT.size
+    offset += -offset % 8
+    table = []
+    for name, bloom, hashes in built:
+        table.append(_SEGMENT.pack(name.encode(), offset, len(bloom), len(hashes)))
+        offset += len(bloom) + len(hashes) * 8
+
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=SNAPSHOT_DIR, prefix=f".rule_{rule_id}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(built), version))
+            f.write(b"".join(table))
+            f.write(b"\0" * (-f.tell() % 8))
+            for _, bloom, hashes in built:
+                f.write(bloom)
+                f.write(hashes.tobytes())
+        os.replace(tmp_path, snapshot_path(rule_id))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return snapshot_path(rule_id)
+
+
+def open_snapshot(rule_id: int) -> Optional[ValueSnapshot]:
+    """映射规则的值快照，不存在或损坏时返回 None"""
+    try:
+        return ValueSnapshot(snapshot_path(rule_id))
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def remove_snapshot(rule_id: int):
+    try:
+        os.unlink(snapshot_path(rule_id))
+    except FileNotFoundError:
+        pass
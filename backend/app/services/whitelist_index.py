@@ -0,0 +1,75 @@
+"""哈希白名单索引
+
+每个值集合存成两部分：
+- Bloom 过滤器：绝大多数"不在白名单"的请求在这里直接被拒绝，不触及主表；
+- 升序去重的 64 位哈希数组：Bloom 判定可能存在时再二分确认。
+
+两部分都是连续的字节/整数缓冲区，既可以在进程内构建，也可以直接指向 mmap 映射的快照文件。
+"""
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Tuple
+import hashlib
+
+BLOOM_BITS_PER_VALUE = 10
+BLOOM_HASHES = 5  # 每值 10 bit、5 个哈希函数，误判率约 1%
+
+
+def hash_value(value: str) -> int:
+    """值的 64 位哈希（跨进程稳定）"""
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "little")
+
+
+def _bloom_positions(h: int, m: int):
+    # 双重哈希：由一个 64 位哈希派生 k 个位置
+    h1 = h & 0xFFFFFFFF
+    h2 = (h >> 32) | 1
+    for i in range(BLOOM_HASHES):
+        yield (h1 + i * h2) % m
+
+
+def build_index(values: Iterable[str]) -> Tuple[bytearray, array]:
+    """构建 (Bloom 位图, 升序哈希数组)，位图长度按 8 字节对齐"""
+    hashes = array("Q", sorted({hash_value(v) for v in values}))
+    m = -(-len(hashes) * BLOOM_BITS_PER_VALUE // 64) * 64
+    bloom = bytearray(m // 8)
+    for h in hashes:
+        for pos in _bloom_positions(h, m):
+            bloom[pos >> 3] |= 1 << (pos & 7)
+    return bloom, hashes
+
+
+class HashedValueSet:
+    """Bloom 预检 + 有序哈希数组的只读集合，支持 `value in s`"""
+    __slots__ = ("_bloom", "_bloom_bits", "_hashes")
+
+    def __init__(self, bloom, hashes):
+        self._bloom = bloom
+        self._bloom_bits = len(bloom) * 8
+        self._hashes = hashes
+
+    @classmethod
+    def from_values(cls, values: Iterable[str]) -> "HashedValueSet":
+        return cls(*build_index(values))
+
+    def contains_hash(self, h: int) -> bool:
+        m = self._bloom_bits
+        if not m:
+            return False
+        bloom = self._bloom
+        # 与 _bloom_positions 相同的位置序列，内联以减少热路径开销
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        for i in range(BLOOM_HASHES):
+            pos = (h1 + i * h2) % m
+            if not bloom[pos >> 3] & (1 << (pos & 7)):
+                return False
+        hashes = self._hashes
+        i = bisect_left(hashes, h)
+        return i < len(hashes) and hashes[i] == h
+
+    def __contains__(self, value: str) -> bool:
+        return self.contains_hash(hash_value(value))
+
+    def __len__(self) -> int:
+        return len(self._hashes)
@@ -0,0 +1 @@
+"""决策路径与管理批量操作的基准测试（python -m benchmarks.run）"""
@@ -0,0 +1,92 @@
+"""进程内 ASGI 调用器：直接构造 scope 调用应用，不经过网络和 HTTP 客户端库"""
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+import asyncio
+import json
+
+
+class AsgiResponse:
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status: int, headers: List[Tuple[bytes, bytes]], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def header(self, name: str) -> Optional[str]:
+        key = name.lower().encode("latin-1")
+        for k, v in self.headers:
+            if k == key:
+                return v.decode("latin-1")
+        return None
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class AsgiClient:
+    """最小的 ASGI HTTP 调用器（不运行 lifespan，由调用方自行初始化）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        headers: Optional[Dict[str, str]] = None,
+        body: bytes = b"",
+        params: Optional[dict] = None,
+        json_body=None,
+    ) -> AsgiResponse:
+        raw_headers = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()]
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            raw_headers.append((b"content-type", b"application/json"))
+        if body:
+            raw_headers.append((b"content-length", str(len(body)).encode()))
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": urlencode(params or {}, doseq=True).encode(),
+            "root_path": "",
+            "headers": raw_headers,
+            "client": ("127.0.0.1", 50000),
+            "server": ("testserver", 80),
+        }
+        sent_body = False
+        never = asyncio.Event()
+
+        async def receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # 请求体已发送完毕：客户端保持连接，直到应用发完响应
+            await never.wait()
+
+        status = 0
+        response_headers: List[Tuple[bytes, bytes]] = []
+        chunks = []
+
+        async def send(message):
+            nonlocal status, response_headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return AsgiResponse(status, response_headers, b"".join(chunks))
+
+    async def get(self, path: str, **kwargs) -> AsgiResponse:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> AsgiResponse:
+        return await self.request("POST", path, **kwargs)
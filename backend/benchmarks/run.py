@@ -0,0 +1,339 @@
+"""
+基准测试入口
+
+    cd backend
+    python -m benchmarks.run [--quick | --full] [--output results.json] [--compare baseline.json]
+
+每组配置（规则数 × 白名单大小）使用临时 SQLite 数据库和快照目录，生成合成规则集后测量：
+
+- decision.cold：清空所有进程内缓存和规则集快照后的首次决策（含读库、编译计划、发布快照）
+- decision.cold_snapshot：清空进程内缓存后从规则集快照启动的首次决策
+- decision.warm / decision.uncached：GrayService.make_decision，决策结果缓存开启 / 关闭
+- http.auth / http.fast_auth：经进程内 ASGI 调用的 /api/gray/auth 与 /api/gray/fast-auth
+- admin.rules_list / admin.whitelist_list：规则列表、白名单列表查询
+- admin.whitelist_batch / admin.whitelist_import：批量添加白名单（JSON 数组）与流式导入
+
+结果为 JSON（含 git 提交号），可用 --compare 与另一次的结果逐项对比 p50。
+"""
+import os
+import sys
+import tempfile
+
+# 必须在导入应用之前指向临时数据库：基准测试会清空并重建表
+_WORKDIR = tempfile.mkdtemp(prefix="gray-bench-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_WORKDIR}/bench.db"
+os.environ["SNAPSHOT_DIR"] = os.path.join(_WORKDIR, "snapshots")
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import shutil
+import subprocess
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+import jwt
+from sqlalchemy import insert
+
+from config import RULE_SET_SNAPSHOT_PATH
+from app.main import app
+from app.models import (
+    Base, GrayDecisionRequest, GrayRuleDB, RuleChangeDB, WhitelistDB,
+    async_session, engine, init_db,
+)
+from app.services.decision_cache import decision_cache
+from app.services.gray_service import GrayService, rules_cache
+from app.services.jwt_identity import jwt_identity_cache
+from benchmarks.asgi import AsgiClient
+
+QUICK = {"rules": [10, 100], "whitelist": [10, 10_000]}
+DEFAULT = {"rules": [10, 100, 1000], "whitelist": [10, 10_000, 100_000]}
+FULL = {"rules": [10, 100, 1000], "whitelist": [10, 10_000, 100_000, 1_000_000]}
+
+INSERT_CHUNK = 50_000
+REQUEST_POOL = 2000
+
+
+# ===== 合成数据 =====
+
+def _jwt_cookie(cname: str) -> str:
+    token = jwt.encode(
+        {"data": {"cname": cname, "name": cname}, "exp": int(time.time()) + 86400},
+        "benchmark-secret-key-benchmark-secret",
+    )
+    return quote(f"JWT {token}")
+
+
+async def seed(rule_count: int, whitelist_size: int, rng: random.Random) -> dict:
+    """重建数据库并写入合成规则集，返回生成请求所需的信息"""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await init_db()
+    shutil.rmtree(os.environ["SNAPSHOT_DIR"], ignore_errors=True)
+
+    rules = [{
+        "id": 1, "name": "whitelist", "priority": rule_count, "match_type": "whitelist",
+        "match_values": [], "target_version": "gray", "is_enabled": True,
+    }]
+    header_rules, cookie_rules = [], []
+    for i in range(2, rule_count + 1):
+        kind = ("header", "ip", "cookie", "percentage")[i % 4]
+        rule = {
+            "id": i, "name": f"{kind}-{i}", "priority": rng.randint(0, rule_count),
+            "match_type": kind, "match_key": None, "match_values": [],
+            "target_version": "gray", "is_enabled": True,
+        }
+        if kind == "header":
+            rule["match_key"] = f"X-Flag-{i}"
+            rule["match_values"] = ["on"]
+            header_rules.append(i)
+        elif kind == "ip":
+            rule["match_values"] = [f"10.{i % 256}.{i // 256 % 256}.0/24"]
+        elif kind == "cookie":
+            rule["match_key"] = "token"
+            rule["match_values"] = [f"member-{i}"]
+            cookie_rules.append(i)
+        else:
+            rule["rollout_percentage"] = 1.0
+        rules.append(rule)
+
+    async with async_session() as session:
+        await session.execute(insert(GrayRuleDB), rules)
+        for start in range(0, whitelist_size, INSERT_CHUNK):
+            await session.execute(insert(WhitelistDB), [
+                {"rule_id": 1, "value": f"user-{n}", "value_type": "user_id", "is_enabled": True}
+                for n in range(start, min(start + INSERT_CHUNK, whitelist_size))
+            ])
+        session.add(RuleChangeDB(rule_id=1, entity="rule", action="create"))
+        await session.commit()
+
+    return {"whitelist_size": whitelist_size, "header_rules": header_rules, "cookie_rules": cookie_rules}
+
+
+def make_requests(data: dict, rng: random.Random) -> list:
+    """请求池：白名单命中 / 未命中、Header、JWT cookie、IP 网段各占一部分"""
+    tokens = {i: _jwt_cookie(f"member-{i}") for i in data["cookie_rules"][:50]}
+    outsider_token = _jwt_cookie("outsider")
+    requests = []
+    for n in range(REQUEST_POOL):
+        headers, cookies = {}, {}
+        user_id = f"visitor-{n}"
+        ip = f"172.16.{n % 256}.{n // 256 % 256}"
+        kind = n % 5
+        if kind == 0 and data["whitelist_size"]:
+            user_id = f"user-{rng.randrange(data['whitelist_size'])}"
+        elif kind == 1 and data["header_rules"]:
+            headers[f"X-Flag-{rng.choice(data['header_rules'])}"] = "on"
+        elif kind == 2:
+            cookies["token"] = rng.choice(list(tokens.values())) if tokens else outsider_token
+        elif kind == 3:
+            ip = f"10.{rng.randrange(256)}.0.{rng.randrange(1, 255)}"
+        else:
+            cookies["token"] = outsider_token
+        requests.append(GrayDecisionRequest(user_id=user_id, ip=ip, headers=headers, cookies=cookies))
+    return requests
+
+
+def _auth_headers(request: GrayDecisionRequest) -> dict:
+    headers = {"X-User-Id": request.user_id, "X-Real-IP": request.ip, **request.headers}
+    if request.cookies:
+        headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in request.cookies.items())
+    return headers
+
+
+def reset_caches():
+    rules_cache.clear()
+    decision_cache.clear()
+    jwt_identity_cache.clear()
+
+
+# ===== 计时 =====
+
+def summarize(name: str, params: dict, samples_ns: list) -> dict:
+    samples = sorted(samples_ns)
+    count = len(samples)
+    pick = lambda q: samples[min(count - 1, int(count * q))] / 1000  # noqa: E731
+    total = sum(samples)
+    return {
+        "name": name,
+        **params,
+        "iterations": count,
+        "mean_us": round(total / count / 1000, 3),
+        "p50_us": round(pick(0.50), 3),
+        "p99_us": round(pick(0.99), 3),
+        "max_us": round(samples[-1] / 1000, 3),
+        "ops_per_sec": round(count / (total / 1e9), 1) if total else None,
+    }
+
+
+async def measure(fn, iterations: int) -> list:
+    clock = time.perf_counter_ns
+    samples = []
+    for i in range(iterations):
+        begin = clock()
+        await fn(i)
+        samples.append(clock() - begin)
+    return samples
+
+
+# ===== 场景 =====
+
+async def bench_config(rule_count: int, whitelist_size: int, iterations: int, rng: random.Random) -> list:
+    params = {"rules": rule_count, "whitelist_size": whitelist_size}
+    seed_started = time.perf_counter()
+    data = await seed(rule_count, whitelist_size, rng)
+    print(f"# rules={rule_count} whitelist={whitelist_size} seeded in {time.perf_counter() - seed_started:.1f}s",
+          file=sys.stderr)
+    requests = make_requests(data, rng)
+    client = AsgiClient(app)
+    results = []
+
+    async with async_session() as session:
+        service = GrayService(session)
+
+        async def cold(i):
+            reset_caches()
+            if os.path.exists(RULE_SET_SNAPSHOT_PATH):
+                os.unlink(RULE_SET_SNAPSHOT_PATH)
+            await service.make_decision(requests[i % len(requests)])
+
+        results.append(summarize("decision.cold", params, await measure(cold, 3)))
+
+        async def cold_snapshot(i):
+            reset_caches()
+            await service.make_decision(requests[i % len(requests)])
+
+        results.append(summarize("decision.cold_snapshot", params, await measure(cold_snapshot, 3)))
+
+        async def decide(i):
+            await service.make_decision(requests[i % len(requests)])
+
+        await measure(decide, len(requests))  # 预热（JWT 解码缓存、决策缓存）
+        results.append(summarize("decision.warm", params, await measure(decide, iterations)))
+
+        maxsize = decision_cache.maxsize
+        decision_cache.maxsize = 0
+        try:
+            results.append(summarize("decision.uncached", params, await measure(decide, iterations)))
+        finally:
+            decision_cache.maxsize = maxsize
+
+    auth_headers = [_auth_headers(r) for r in requests]
+    for name, path in (("http.auth", "/api/gray/auth"), ("http.fast_auth", "/api/gray/fast-auth")):
+        async def call(i, path=path):
+            response = await client.get(path, headers=auth_headers[i % len(auth_headers)])
+            assert response.status == 200, response.body
+
+        await measure(call, 200)
+        results.append(summarize(name, params, await measure(call, iterations)))
+
+    async def rules_list(i):
+        await client.get("/api/admin/rules")
+
+    results.append(summarize("admin.rules_list", params, await measure(rules_list, 20)))
+
+    async def whitelist_list(i):
+        await client.get("/api/admin/rules/1/whitelist")
+
+    results.append(summarize("admin.whitelist_list", params, await measure(whitelist_list, 3)))
+
+    batch_size = 1000
+
+    async def whitelist_batch(i):
+        values = [f"batch-{i}-{n}" for n in range(batch_size)]
+        response = await client.post("/api/admin/whitelist/batch", params={"rule_id": 1}, json_body=values)
+        assert response.json()["code"] == 0, response.body
+
+    results.append(summarize("admin.whitelist_batch", {**params, "batch_size": batch_size},
+                             await measure(whitelist_batch, 3)))
+
+    import_size = 10_000
+
+    async def whitelist_import(i):
+        body = "\n".join(f"import-{i}-{n}" for n in range(import_size)).encode()
+        response = await client.post("/api/admin/whitelist/import", params={"rule_id": 1}, body=body,
+                                     headers={"Content-Type": "text/plain"})
+        assert response.json()["code"] == 0, response.body
+
+    results.append(summarize("admin.whitelist_import", {**params, "batch_size": import_size},
+                             await measure(whitelist_import, 3)))
+    return results
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(baseline_path: str, results: list):
+    """按 (name, rules, whitelist_size) 对比 p50，输出到 stderr"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    key = lambda r: (r["name"], r["rules"], r["whitelist_size"])  # noqa: E731
+    previous = {key(r): r for r in baseline["results"]}
+    print(f"# compared with {baseline['meta'].get('commit') or baseline_path}", file=sys.stderr)
+    for result in results:
+        old = previous.get(key(result))
+        if old and old["p50_us"]:
+            ratio = result["p50_us"] / old["p50_us"]
+            print(f"{result['name']:<24} rules={result['rules']:<5} wl={result['whitelist_size']:<8} "
+                  f"p50 {old['p50_us']:>10.1f} -> {result['p50_us']:>10.1f} us  x{ratio:.2f}", file=sys.stderr)
+
+
+async def main_async(args):
+    # 基准测试不计入 SQL 日志输出的开销
+    engine.echo = False
+    profile = QUICK if args.quick else FULL if args.full else DEFAULT
+    rng = random.Random(args.seed)
+    results = []
+    try:
+        for rule_count in profile["rules"]:
+            for whitelist_size in profile["whitelist"]:
+                results.extend(await bench_config(rule_count, whitelist_size, args.iterations, rng))
+    finally:
+        reset_caches()
+        await engine.dispose()
+        shutil.rmtree(_WORKDIR, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "seed": args.seed,
+            "iterations": args.iterations,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        compare(args.compare, results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="灰度决策基准测试")
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("--quick", action="store_true", help="小规模配置，用于快速检查")
+    size.add_argument("--full", action="store_true", help="包含 100 万白名单的完整配置")
+    parser.add_argument("--iterations", type=int, default=5000, help="热路径场景的迭代次数")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子，保证数据集可复现")
+    parser.add_argument("--output", default="", help="结果写入文件（默认输出到标准输出）")
+    parser.add_argument("--compare", default="", help="与之前的结果文件对比 p50")
+    asyncio.run(main_async(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,51 @@ import os
 
 # 数据库配置
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./gray_release.db")
+DATABASE_ECHO = os.getenv("DATABASE_ECHO", "false").lower() in ("1", "true", "yes")  # 输出 SQL 日志（仅调试）
+
+# 连接池
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# SQLite 连接参数：WAL 下读不阻塞写；NORMAL 同步级别在 WAL 下仍保证一致性
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # 毫秒
+
+# 规则缓存跨进程同步：每个 worker 轮询 rule_changes 的间隔（秒）
+CACHE_SYNC_INTERVAL = float(os.getenv("CACHE_SYNC_INTERVAL", "0.05"))
+# 数据库故障时轮询间隔按指数退避的上限（秒）
+CACHE_SYNC_MAX_BACKOFF = float(os.getenv("CACHE_SYNC_MAX_BACKOFF", "30"))
+
+# 规则值快照：值数量达到阈值的规则发布为 mmap 共享的只读快照文件
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "./snapshots")
+SNAPSHOT_MIN_VALUES = int(os.getenv("SNAPSHOT_MIN_VALUES", "1000"))
+# 规则集快照：worker 启动时先从该文件加载，数据库不可用时继续提供决策（空字符串表示关闭）
+RULE_SET_SNAPSHOT_PATH = os.getenv("RULE_SET_SNAPSHOT_PATH", os.path.join(SNAPSHOT_DIR, "ruleset.bin"))
+
+# JWT cookie 身份解码缓存容量（按原始 cookie 值缓存）
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+
+# 决策结果缓存：按规则实际读取的请求属性缓存决策，规则集变化时自动失效（容量为 0 关闭）
+DECISION_CACHE_SIZE = int(os.getenv("DECISION_CACHE_SIZE", "50000"))
+DECISION_CACHE_TTL = float(os.getenv("DECISION_CACHE_TTL", "30"))
+
+# 决策审计日志（写入独立的 SQLite 文件）
+DECISION_LOG_ENABLED = os.getenv("DECISION_LOG_ENABLED", "false").lower() in ("1", "true", "yes")
+DECISION_LOG_PATH = os.getenv("DECISION_LOG_PATH", "./decision_log.db")
+DECISION_LOG_SAMPLE_RATE = float(os.getenv("DECISION_LOG_SAMPLE_RATE", "1.0"))  # 0-1，有用户ID时按用户采样
+DECISION_LOG_BUFFER_SIZE = int(os.getenv("DECISION_LOG_BUFFER_SIZE", "100000"))  # 缓冲区满时丢弃新记录
+DECISION_LOG_BATCH_SIZE = int(os.getenv("DECISION_LOG_BATCH_SIZE", "1000"))
+DECISION_LOG_FLUSH_INTERVAL = float(os.getenv("DECISION_LOG_FLUSH_INTERVAL", "1.0"))  # 秒
+DECISION_LOG_RETENTION_DAYS = float(os.getenv("DECISION_LOG_RETENTION_DAYS", "7"))  # 0 表示不清理
+
+# 影子规则评估队列上限（满时丢弃并计数）
+SHADOW_QUEUE_SIZE = int(os.getenv("SHADOW_QUEUE_SIZE", "10000"))
+
+# 规则导出为 Nginx map/geo include 文件的默认路径（与 nginx/gray.conf 同目录）
+NGINX_EXPORT_PATH = os.getenv("NGINX_EXPORT_PATH", "../nginx/gray_rules.conf")
 
 # 服务配置
 HOST = os.getenv("HOST", "0.0.0.0")
@@ -0,0 +1,20 @@
+"""测试环境：临时数据库和快照目录，不读写 backend/gray_release.db"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+_TMP_DIR = tempfile.mkdtemp(prefix="gray_release_test_")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_TMP_DIR}/test.db")
+os.environ.setdefault("SNAPSHOT_DIR", os.path.join(_TMP_DIR, "snapshots"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
@@ -0,0 +1,85 @@
+from datetime import datetime, timezone
+import json
+
+from app.models import GrayRuleDB
+from app.services.decision_plan import compile_plan
+from app.services.replay import load_rules_file, parse_records, replay
+
+
+def _plan():
+    rules = [
+        GrayRuleDB(id=1, name="beta", match_type="header", match_key="X-Beta", match_values=["on"],
+                   priority=2, target_version="gray", is_enabled=True, is_shadow=False),
+        GrayRuleDB(id=2, name="office", match_type="ip", match_values=["10.0.0.0/8"],
+                   priority=1, target_version="gray", is_enabled=True, is_shadow=False),
+    ]
+    return compile_plan(rules, {})
+
+
+def test_malformed_records_are_counted_as_invalid():
+    lines = [
+        json.dumps({"headers": {"X-Beta": "on"}}),
+        json.dumps({"user_id": 123}),
+        json.dumps({"headers": ["x"]}),
+        json.dumps({"ip": 5}),
+        json.dumps({"cookies": {"a": 1}}),
+        json.dumps({"cookie": ["a=1"]}),
+        json.dumps(["not", "an", "object"]),
+        "not json",
+        json.dumps({"ip": "10.1.2.3", "cookie": "a=1; b=2"}),
+        json.dumps({"user_id": "alice"}),
+    ]
+    report = replay(_plan(), parse_records(lines, "jsonl"))
+
+    data = report.to_dict()
+    assert data["total"] == 10
+    assert data["invalid"] == 7
+    assert data["gray"] == 2
+    assert data["stable"] == 1
+    assert {item["rule_id"]: item["hits"] for item in data["rules"]} == {1: 1, 2: 1}
+
+
+def test_nginx_combined_lines():
+    lines = [
+        '10.0.0.7 - alice [10/Oct/2026:13:55:36 +0800] "GET / HTTP/1.1" 200 612 "-" "curl/8"',
+        '8.8.8.8 - - [10/Oct/2026:13:55:37 +0800] "GET / HTTP/1.1" 200 612 "-" "curl/8"',
+        "garbage",
+    ]
+    data = replay(_plan(), parse_records(lines, "nginx")).to_dict()
+
+    assert (data["total"], data["invalid"], data["gray"]) == (3, 1, 1)
+
+
+def test_scheduled_rules_follow_record_time(tmp_path):
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(json.dumps([
+        {
+            "id": 1, "name": "launch", "match_type": "header", "match_key": "X-Beta", "match_values": ["on"],
+            "active_from": "2026-10-01T00:00:00Z", "active_until": "2026-10-02T00:00:00Z",
+        },
+    ]))
+    plan = load_rules_file(str(rules_file))
+    lines = [
+        json.dumps({"time": "2026-10-01T12:00:00Z", "headers": {"X-Beta": "on"}}),
+        json.dumps({"time": 1759233600.5, "headers": {"X-Beta": "on"}}),  # 2025-09-30T12:00:00Z
+        json.dumps({"time": "1759320000.000", "headers": {"X-Beta": "on"}}),  # 2025-10-01T12:00:00Z
+        json.dumps({"time": "yesterday", "headers": {"X-Beta": "on"}}),
+        json.dumps({"headers": {"X-Beta": "on"}}),
+    ]
+    at = datetime(2026, 10, 1, 6, tzinfo=timezone.utc).timestamp()
+    data = replay(plan, parse_records(lines, "jsonl"), at).to_dict()
+
+    assert (data["total"], data["invalid"], data["gray"]) == (5, 1, 2)
+    assert [item["rule_id"] for item in data["rules"]] == [1]
+
+    nginx_lines = [
+        '1.2.3.4 - - [01/Oct/2026:20:00:00 +0800] "GET / HTTP/1.1" 200 1 "-" "curl/8"',
+        '1.2.3.4 - - [02/Oct/2026:08:00:00 +0800] "GET / HTTP/1.1" 200 1 "-" "curl/8"',
+    ]
+    office = [
+        {"id": 2, "name": "office", "match_type": "ip", "match_values": ["1.2.3.4"],
+         "active_from": "2026-10-01T00:00:00Z", "active_until": "2026-10-02T00:00:00Z"},
+    ]
+    rules_file.write_text(json.dumps(office))
+    data = replay(load_rules_file(str(rules_file)), parse_records(nginx_lines, "nginx"), at).to_dict()
+    assert data["gray"] == 1
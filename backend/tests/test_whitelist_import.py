@@ -0,0 +1,45 @@
+from app.routes.admin import _WhitelistImport
+
+
+def test_buffer_holds_only_value_strings():
+    importer = _WhitelistImport(None, rule_id=1, value_type="user_id")
+    for i in range(1000):
+        importer.add(f" user{i} ")
+    importer.add("user1")
+    importer.add("")
+
+    assert importer.values == [f"user{i}" for i in range(1000)]
+    assert all(type(value) is str for value in importer.values)
+    assert importer.skipped == 1
+    for attr in vars(importer).values():
+        if isinstance(attr, (list, set)):
+            assert not any(isinstance(item, dict) for item in attr)
+
+
+def test_ip_values_are_validated():
+    importer = _WhitelistImport(None, rule_id=1, value_type="ip")
+    for value in ("10.0.0.1", "10.0.0.0/8", "not-an-ip", "x" * 300):
+        importer.add(value)
+
+    assert importer.values == ["10.0.0.1", "10.0.0.0/8"]
+    assert importer.invalid == 2
+
+
+def test_import_inserts_in_chunks(client, monkeypatch):
+    monkeypatch.setattr(_WhitelistImport, "CHUNK_SIZE", 4)
+    rule = client.post(
+        "/api/admin/rules", json={"name": "import", "match_type": "whitelist", "priority": 1}
+    ).json()["data"]
+    client.post("/api/admin/whitelist", json={"rule_id": rule["id"], "value": "u0"})
+
+    body = "\n".join(f"u{i}" for i in range(10)) + "\nu3\n"
+    result = client.post(
+        "/api/admin/whitelist/import",
+        params={"rule_id": rule["id"]},
+        content=body.encode(),
+        headers={"Content-Type": "text/plain"},
+    ).json()
+
+    assert result["data"] == {"added": 9, "skipped": 2, "invalid": 0}
+    decision = client.post("/api/gray/decide", json={"user_id": "u9"}).json()["data"]
+    assert decision["should_gray"] and decision["matched_rule"] == "import"
@@ -3,6 +3,7 @@ export const MATCH_TYPE_OPTIONS = [
   { value: "header", label: "Header匹配", color: "blue" },
   { value: "cookie", label: "Cookie匹配", color: "purple" },
   { value: "ip", label: "IP匹配", color: "orange" },
+  { value: "percentage", label: "百分比放量", color: "green" },
 ] as const;
 
 export const VALUE_TYPE_OPTIONS = [
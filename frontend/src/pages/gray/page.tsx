@@ -22,6 +22,7 @@ import {
   List,
   Empty,
   Divider,
+  DatePicker,
 } from "antd";
 import {
   PlusOutlined,
@@ -33,6 +34,7 @@ import {
   ReloadOutlined,
   EyeOutlined,
   CopyOutlined,
+  DownloadOutlined,
   CheckCircleOutlined,
 } from "@ant-design/icons";
 import type { ColumnsType } from "antd/es/table";
@@ -49,17 +51,23 @@ import type {
   Whitelist,
   CreateRulePayload,
 } from "@store/gray/slices/admin/initialState";
+import { getWhitelistExportUrl } from "@store/gray/slices/white/api";
 
 import { MATCH_TYPE_OPTIONS, VALUE_TYPE_OPTIONS } from "./config";
 
 const { Title, Text } = Typography;
 const { TextArea } = Input;
 
+// 后端时间为不带时区的 UTC 时间
+const parseUtc = (value?: string | null) => (value ? dayjs(`${value}Z`) : undefined);
+
 export default function GrayPage() {
   const [
     rules,
     currentRule,
     whitelist,
+    whitelistCursor,
+    whitelistTotal,
     loadRules,
     createRule,
     updateRule,
@@ -67,6 +75,7 @@ export default function GrayPage() {
     toggleRule,
     setCurrentRule,
     loadWhitelist,
+    loadMoreWhitelist,
     batchAddWhitelist,
     deleteWhitelist,
     toggleWhitelist,
@@ -74,6 +83,8 @@ export default function GrayPage() {
     state.rules,
     state.currentRule,
     state.whitelist,
+    state.whitelistCursor,
+    state.whitelistTotal,
     state.loadRules,
     state.createRule,
     state.updateRule,
@@ -81,6 +92,7 @@ export default function GrayPage() {
     state.toggleRule,
     state.setCurrentRule,
     state.loadWhitelist,
+    state.loadMoreWhitelist,
     state.batchAddWhitelist,
     state.deleteWhitelist,
     state.toggleWhitelist,
@@ -108,6 +120,8 @@ export default function GrayPage() {
       form.setFieldsValue({
         ...rule,
         match_values: rule.match_values?.join("\n") || "",
+        active_from: parseUtc(rule.active_from),
+        active_until: parseUtc(rule.active_until),
       });
     } else {
       form.resetFields();
@@ -127,6 +141,8 @@ export default function GrayPage() {
               .map((s: string) => s.trim())
               .filter(Boolean)
           : [],
+        active_from: values.active_from ? values.active_from.toISOString() : null,
+        active_until: values.active_until ? values.active_until.toISOString() : null,
       };
 
       if (editingRule) {
@@ -229,7 +245,25 @@ export default function GrayPage() {
       dataIndex: "name",
       render: (name: string, record) => (
         <Space direction="vertical" size={0}>
-          <Text strong>{name}</Text>
+          <Space size={4}>
+            <Text strong>{name}</Text>
+            {record.is_shadow && <Tag color="purple">影子</Tag>}
+            {(record.active_from || record.active_until || record.rollout_steps?.length) && (
+              <Tooltip
+                title={[
+                  record.active_from && `开始: ${parseUtc(record.active_from)?.format("YYYY-MM-DD HH:mm")}`,
+                  record.active_until && `结束: ${parseUtc(record.active_until)?.format("YYYY-MM-DD HH:mm")}`,
+                  ...(record.rollout_steps || []).map(
+                    (step) => `${parseUtc(step.at)?.format("YYYY-MM-DD HH:mm")} 放量 ${step.percentage}%`
+                  ),
+                ]
+                  .filter(Boolean)
+                  .join("；")}
+              >
+                <Tag color="geekblue">定时</Tag>
+              </Tooltip>
+            )}
+          </Space>
           {record.description && (
             <Text type="secondary" style={{ fontSize: 12 }}>
               {record.description}
@@ -437,6 +471,7 @@ export default function GrayPage() {
           layout="vertical"
           initialValues={{
             is_enabled: true,
+            is_shadow: false,
             priority: 0,
             match_type: "whitelist",
             target_version: "gray",
@@ -476,13 +511,37 @@ export default function GrayPage() {
             noStyle
             shouldUpdate={(prev, cur) => prev.match_type !== cur.match_type}
           >
-            {({ getFieldValue }) =>
-              ["header", "cookie"].includes(getFieldValue("match_type")) && (
-                <Form.Item name="match_key" label="匹配键名">
-                  <Input placeholder="例如: X-User-Type 或 cookie名" />
-                </Form.Item>
-              )
-            }
+            {({ getFieldValue }) => (
+              <>
+                {["header", "cookie"].includes(getFieldValue("match_type")) && (
+                  <Form.Item name="match_key" label="匹配键名">
+                    <Input placeholder="例如: X-User-Type 或 cookie名" />
+                  </Form.Item>
+                )}
+                {getFieldValue("match_type") === "percentage" && (
+                  <Row gutter={16}>
+                    <Col span={12}>
+                      <Form.Item
+                        name="match_key"
+                        label="分桶键"
+                        tooltip="user_id、ip、cookie:<名称> 或 header:<名称>，留空为 user_id"
+                      >
+                        <Input placeholder="user_id" />
+                      </Form.Item>
+                    </Col>
+                    <Col span={12}>
+                      <Form.Item
+                        name="rollout_percentage"
+                        label="放量比例（%）"
+                        rules={[{ required: true, message: "请输入放量比例" }]}
+                      >
+                        <InputNumber min={0} max={100} step={0.01} style={{ width: "100%" }} />
+                      </Form.Item>
+                    </Col>
+                  </Row>
+                )}
+              </>
+            )}
           </Form.Item>
 
           <Form.Item
@@ -509,9 +568,31 @@ export default function GrayPage() {
             </Col>
           </Row>
 
+          <Row gutter={16}>
+            <Col span={12}>
+              <Form.Item name="active_from" label="生效开始时间" tooltip="留空表示立即生效">
+                <DatePicker showTime style={{ width: "100%" }} />
+              </Form.Item>
+            </Col>
+            <Col span={12}>
+              <Form.Item name="active_until" label="生效结束时间" tooltip="留空表示一直有效">
+                <DatePicker showTime style={{ width: "100%" }} />
+              </Form.Item>
+            </Col>
+          </Row>
+
           <Form.Item name="is_enabled" valuePropName="checked" label="启用状态">
             <Switch checkedChildren="启用" unCheckedChildren="禁用" />
           </Form.Item>
+
+          <Form.Item
+            name="is_shadow"
+            valuePropName="checked"
+            label="影子模式"
+            tooltip="影子规则只在后台统计上线后会命中的流量（见 /metrics），不影响实际路由"
+          >
+            <Switch checkedChildren="影子" unCheckedChildren="线上" />
+          </Form.Item>
         </Form>
       </Modal>
 
@@ -556,12 +637,24 @@ export default function GrayPage() {
                 message.success("已复制到剪贴板");
               }}
             >
-              导出当前
+              复制已加载
+            </Button>
+            <Button
+              icon={<DownloadOutlined />}
+              disabled={!currentRule}
+              onClick={() =>
+                currentRule &&
+                window.open(getWhitelistExportUrl(currentRule.id), "_blank")
+              }
+            >
+              下载全部
             </Button>
           </Space>
         </Card>
 
-        <Divider orientation="left">已有白名单 ({whitelist.length})</Divider>
+        <Divider orientation="left">
+          已有白名单 ({whitelist.length} / {whitelistTotal})
+        </Divider>
 
         <List
           // loading={whitelistLoading}
@@ -613,6 +706,11 @@ export default function GrayPage() {
             </List.Item>
           )}
         />
+        {whitelistCursor && (
+          <div style={{ textAlign: "center", marginTop: 12 }}>
+            <Button onClick={() => loadMoreWhitelist()}>加载更多</Button>
+          </div>
+        )}
       </Drawer>
     </div>
   );
@@ -24,10 +24,16 @@ export const createGrayAdminSlice: StateCreator<
   [],
   GrayAdminAction
 > = (set, get) => ({
-  // 加载规则列表
+  // 加载规则列表（按游标逐页取完）
   loadRules: async () => {
-    const res = await apiGetRules();
-    set({ rules: res.data || [] });
+    const rules: GrayRule[] = [];
+    let cursor: string | undefined;
+    do {
+      const res = await apiGetRules({ limit: 1000, cursor });
+      rules.push(...(res.data?.items || []));
+      cursor = res.data?.next_cursor || undefined;
+    } while (cursor);
+    set({ rules });
   },
 
   // 创建规则
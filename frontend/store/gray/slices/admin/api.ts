@@ -1,11 +1,15 @@
 import request from "@config/request";
-import type { GrayRule, CreateRulePayload } from "./initialState";
+import type { GrayRule, CreateRulePayload, CursorPage } from "./initialState";
 
 /**
- * 获取规则列表
+ * 获取规则列表（游标分页）
  */
-export function apiGetRules(params?: { is_enabled?: boolean }) {
-  return request.get<GrayRule[]>(`/admin/rules`, params);
+export function apiGetRules(params?: {
+  is_enabled?: boolean;
+  limit?: number;
+  cursor?: string;
+}) {
+  return request.get<CursorPage<GrayRule>>(`/admin/rules`, params);
 }
 
 /**
@@ -1,13 +1,24 @@
+// 定时放量步骤（at 为 UTC 时间）
+export interface RolloutStep {
+  at: string;
+  percentage: number;
+}
+
 // 灰度规则类型定义
 export interface GrayRule {
   id: number;
   name: string;
   description?: string;
   is_enabled: boolean;
+  is_shadow?: boolean;
   priority: number;
   match_type: string;
   match_key?: string;
   match_values: string[];
+  rollout_percentage?: number | null;
+  active_from?: string | null;
+  active_until?: string | null;
+  rollout_steps?: RolloutStep[] | null;
   target_version: string;
   target_upstream?: string;
   created_at: string;
@@ -19,14 +30,26 @@ export interface CreateRulePayload {
   name: string;
   description?: string;
   is_enabled?: boolean;
+  is_shadow?: boolean;
   priority?: number;
   match_type?: string;
   match_key?: string;
   match_values?: string[];
+  rollout_percentage?: number | null;
+  active_from?: string | null;
+  active_until?: string | null;
+  rollout_steps?: RolloutStep[] | null;
   target_version?: string;
   target_upstream?: string;
 }
 
+// 游标分页响应（next_cursor 为空表示没有下一页）
+export interface CursorPage<T> {
+  items: T[];
+  next_cursor: string | null;
+  total?: number;
+}
+
 // 白名单类型定义
 export interface Whitelist {
   id: number;
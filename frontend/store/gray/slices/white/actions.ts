@@ -9,6 +9,7 @@ import {
 
 export interface GrayWhiteAction {
   loadWhitelist: (ruleId: number) => Promise<void>;
+  loadMoreWhitelist: () => Promise<void>;
   batchAddWhitelist: (
     ruleId: number,
     values: string[],
@@ -24,10 +25,28 @@ export const createGrayWhiteSlice: StateCreator<
   [],
   GrayWhiteAction
 > = (set, get) => ({
-  // 加载白名单
+  // 加载白名单第一页
   loadWhitelist: async (ruleId: number) => {
     const res = await apiGetWhitelist(ruleId);
-    set({ whitelist: res.data || [] });
+    set({
+      whitelist: res.data?.items || [],
+      whitelistCursor: res.data?.next_cursor || null,
+      whitelistTotal: res.data?.total || 0,
+    });
+  },
+
+  // 加载下一页白名单
+  loadMoreWhitelist: async () => {
+    const { currentRule, whitelistCursor, whitelist } = get();
+    if (!currentRule || !whitelistCursor) return;
+    const res = await apiGetWhitelist(currentRule.id, {
+      cursor: whitelistCursor,
+    });
+    set({
+      whitelist: [...whitelist, ...(res.data?.items || [])],
+      whitelistCursor: res.data?.next_cursor || null,
+      whitelistTotal: res.data?.total || 0,
+    });
   },
 
   // 批量添加白名单
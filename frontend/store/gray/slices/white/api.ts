@@ -1,4 +1,5 @@
 import request from "@config/request";
+import type { CursorPage } from "../admin/initialState";
 import type {
   Whitelist,
   CreateWhitelistPayload,
@@ -8,10 +9,26 @@ import type {
 // ==================== 白名单 API ====================
 
 /**
- * 获取规则的白名单列表
+ * 获取规则的白名单列表（游标分页）
  */
-export function apiGetWhitelist(ruleId: number) {
-  return request.get<Whitelist[]>(`/admin/rules/${ruleId}/whitelist`);
+export function apiGetWhitelist(
+  ruleId: number,
+  params?: { limit?: number; cursor?: string }
+) {
+  return request.get<CursorPage<Whitelist>>(
+    `/admin/rules/${ruleId}/whitelist`,
+    params
+  );
+}
+
+/**
+ * 完整白名单导出地址（服务端流式输出）
+ */
+export function getWhitelistExportUrl(
+  ruleId: number,
+  format: "csv" | "ndjson" = "csv"
+) {
+  return `${process.env.API_PREFIX}/admin/rules/${ruleId}/whitelist/export?format=${format}`;
 }
 
 /**
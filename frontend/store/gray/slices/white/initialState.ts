@@ -25,10 +25,16 @@ export interface BatchAddWhitelistResponse {
 }
 
 export interface GrayWhiteState {
-  // 白名单列表
+  // 白名单列表（已加载的分页）
   whitelist: Whitelist[];
+  // 下一页游标，为空表示已加载完
+  whitelistCursor: string | null;
+  // 白名单总数
+  whitelistTotal: number;
 }
 
 export const initialState: GrayWhiteState = {
   whitelist: [],
+  whitelistCursor: null,
+  whitelistTotal: 0,
 };